@@ -9,9 +9,14 @@ window.dash_props = Object.assign({}, window.dash_props, {
 window.dash_props = Object.assign({}, window.dash_props, {
     module: {
         on_each_feature: function (feature, layer, context) {
-            // Add popup.
-            if (feature.properties.popup) {
-                const el = layer.bindPopup(feature.properties.popup).openPopup()
+            // Add popup.  The layer has every year, so the value is the hideout color_prop
+            if (feature.properties.name) {
+                const popup = function () {
+                    const hideout = context.props.hideout || {};
+                    const value = Number(feature.properties[hideout.color_prop]);
+                    return "$" + value.toFixed(0) + " per capita    " + feature.properties.name;
+                }
+                const el = layer.bindPopup(popup).openPopup()
                 // Check if feature id is matching the id for which the popup should be open.
                 if(context.props.hideout && feature.properties.id === context.props.hideout.open){
                     const {map} = context.props.leaflet;  // get the map object
@@ -20,6 +20,9 @@ census -  state full financial statements
 expenditures report
 revenue report
 
+The expenditures and revenue reports are also saved in the columnar (parquet) data
+store in data/parquet.  See data_utilities.read_data()
+
 
 """
 
@@ -29,6 +32,7 @@ import pathlib
 import pickle
 
 import data_utilities as du
+import data_store
 
 pd.set_option("display.max_rows", 100)
 pd.set_option("display.max_columns", 12)
@@ -55,7 +59,7 @@ def census_financial_statement(filea, fileb):
     # be sure to update for new data
     skip = 7 if filea.startswith(("12", "17")) else 9
 
-    dfa = pd.read_excel(
+    dfa = du.read_excel_cached(
         DATA_PREP_PATH.joinpath(filea), skiprows=skip, header=[0, 4], nrows=175
     )
     dfa = (
@@ -70,7 +74,7 @@ def census_financial_statement(filea, fileb):
     dfa = dfa.rename(columns={"Unnamed: 0_level_1": "Line"}, level=1)
     dfa = dfa.rename(columns={"Unnamed: 1_level_1": "Description"}, level=1)
 
-    dfb = pd.read_excel(
+    dfb = du.read_excel_cached(
         DATA_PREP_PATH.joinpath(fileb), skiprows=skip, header=[0, 4], nrows=175
     )
 
@@ -109,23 +113,7 @@ with open(DATA_PATH.joinpath("census.pickle"), "wb") as handle:
 
 
 ######################  Read Population by State  ################################
-def read_census_pop():
-    """Returns a df of stat population based on census data:
-    https://www.census.gov/data/tables/time-series/demo/popest/2010s-state-total.html
-    """
-
-    df = pd.read_excel(
-        DATA_PATH.joinpath("nst-est2019-01.xlsx"), skiprows=1, header=2, nrows=56
-    )
-    # remove the regions (states only) and rename state col
-    df_state_pop = df.tail(51).reindex()  # states+DC
-    df_state_pop = df_state_pop.rename(columns={"Unnamed: 0": "State"})
-    ## for some strange reason, the States had a "." at the start
-    df_state_pop["State"] = df_state_pop["State"].str.replace(".", "")
-    return df_state_pop
-
-
-df_pop_2010_to_2019 = read_census_pop()
+df_pop_2010_to_2019 = data_store.read_census_pop()
 
 
 def pop_by_yr(year):
@@ -257,6 +245,7 @@ df_exp.fillna(0, inplace=True)
 
 with open(DATA_PATH.joinpath("df_exp.pickle"), "wb") as handle:
     pickle.dump(df_exp, handle, protocol=pickle.HIGHEST_PROTOCOL)
+du.write_parquet(df_exp, "df_exp")
 
 print("df_exp, the expenditures df is saved as a pickle file in  \data ")
 print("working on revenues")
@@ -296,8 +285,12 @@ df_rev.fillna(0, inplace=True)
 
 with open(DATA_PATH.joinpath("df_rev.pickle"), "wb") as handle:
     pickle.dump(df_rev, handle, protocol=pickle.HIGHEST_PROTOCOL)
+du.write_parquet(df_rev, "df_rev")
 
 print("df_rev, the revenue df is saved as a pickle file in  \data ")
 
+# memory mapped copy of the numbers shared by the app's worker processes (see serve.py)
+du.write_arena({"df_exp": df_exp, "df_rev": df_rev}, "state")
+
 print("done")
 ##################  End Revenue   ########################################
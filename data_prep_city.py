@@ -69,6 +69,11 @@ Output:  Pickled files for:
   3) Fin_GID.pickle                            
 
   4) df_city_exp.pickle                        Revenue and Expense reports     df_city_rev.pickle     
+
+Output:  Columnar (parquet) data store in data/parquet  (see data_utilities.read_data)
+  1) df_summary.parquet
+  2) local/report=exp/state=AL/...             All the exp_rev_XX files in one dataset
+                                               partitioned by report and state
 """
 
 
@@ -121,6 +126,7 @@ for cat in du.expenditure_cats:
 
 with open(DATA_PATH.joinpath("df_summary.pickle"), "wb") as handle:
     pickle.dump(df_summary, handle, protocol=pickle.HIGHEST_PROTOCOL)
+du.write_parquet(df_summary, "df_summary")
 
 # create a dictionary from dff_summary because the df keeps the Item codes as
 #     an object but we need a list of categories to do the filter
@@ -129,6 +135,13 @@ summary_dict = dff_summary["Item Codes"].to_dict()
 for line in summary_dict:
     summary_dict[line] = summary_dict[line].split(", ")
 
+# mapping table with one row for each (Item code, Line).  An item code can be in more
+# than one line.  "Line order" keeps the order of the lines in the summary report.
+df_item_line = pd.DataFrame(
+    {"Line order": range(len(summary_dict)), "Item code": list(summary_dict.values())}
+).explode("Item code")
+df_item_line = df_item_line.drop_duplicates(ignore_index=True)
+
 
 print("starting fin")
 ################# Individual data file ####################################
@@ -162,22 +175,21 @@ def make_financial_statement(file):
         "Imputation type",
     ]
 
-    idcodes = list(df_fin["ID code"].unique())
+    # makes  one financial statement for each city: join each item to the line(s)
+    # it is included in, then sum by city and line in a single pass.
+    df_fin = df_fin.merge(df_item_line, on="Item code")
+    df_fin = (
+        df_fin.groupby(["ID code", "Line order"])["Amount"]
+        .sum()
+        .astype("float64")
+        .reset_index()
+    )
+    df_fin = df_fin[df_fin["Amount"] > 0]
 
-    # makes  one financial statement for each city.
-    df_fin_line = []
-    for line in summary_dict:
-        df_fin["Line amount"] = df_fin[df_fin["Item code"].isin(summary_dict[line])][
-            "Amount"
-        ]
-        dff_fin = df_fin.groupby("ID code").sum().reset_index()
-        dff_fin = dff_fin[dff_fin["Line amount"] > 0]
-        dff_fin["Line"] = line
-        dff_fin = dff_fin[["ID code", "Line", "Line amount"]]
-        df_fin_line.append(dff_fin)
-    df_fin = pd.concat(df_fin_line)
-    df_fin.columns = ["ID code", "Line", "Amount"]
-    return df_fin
+    # same order as the summary report: by line, then by ID code
+    df_fin = df_fin.sort_values(["Line order", "ID code"], ignore_index=True)
+    df_fin["Line"] = df_fin["Line order"].map(dict(enumerate(summary_dict)))
+    return df_fin[["ID code", "Line", "Amount"]]
 
 
 fin_filenames = {
@@ -411,23 +423,56 @@ df_id = Fin_GID["2017"][["ID code", "ST", "ID name", "County name"]].copy()
 df_id["Gov Type"] = df_id["ID code"].str[2]
 df_id["ID name"] = df_id["ID name"] + ", " + df_id["ST"]
 
+# Save the final schema used in the app so loading a state is just a read:
+# "ID code" is renamed to "id" and Category and Description are included
+df_cat_desc = df_summary[["Line", "Category", "Description"]]
+df_city_exp = pd.merge(df_city_exp, df_id, how="left", on="ID code")
+df_city_exp = du.local_app_schema(df_city_exp, df_cat_desc)
+df_city_rev = pd.merge(df_city_rev, df_id, how="left", on="ID code")
+df_city_rev = du.local_app_schema(df_city_rev, df_cat_desc)
+
+# Set to True to save a sparkline for each entity and Line in the data files.  Tables
+# with one row per Line then don't make them in the app, but the files are larger.
+PRECOMPUTE_SPARKLINES = False
+if PRECOMPUTE_SPARKLINES:
+    df_city_exp = du.add_sparklines(df_city_exp)
+    df_city_rev = du.add_sparklines(df_city_rev)
+
+local_reports = []
 for code in du.code_state:
-    df_exp = df_city_exp[df_city_exp["ID code"].str[:2] == code]
-    df_exp = pd.merge(df_exp, df_id, how="left", on="ID code")
-
-    df_rev = df_city_rev[df_city_rev["ID code"].str[:2] == code]
-    df_rev = pd.merge(df_rev, df_id, how="left", on="ID code")
+    df_exp = df_city_exp[df_city_exp["id"].str[:2] == code].reset_index(drop=True)
+    df_rev = df_city_rev[df_city_rev["id"].str[:2] == code].reset_index(drop=True)
 
     filename = "".join(["exp_rev_", du.code_abbr[code], ".pickle"])
 
     with open(DATA_PATH.joinpath(filename), "wb") as handle:
         pickle.dump((df_exp, df_rev), handle, protocol=pickle.HIGHEST_PROTOCOL)
 
+    local_reports.append(df_exp.assign(report="exp", state=du.code_abbr[code]))
+    local_reports.append(df_rev.assign(report="rev", state=du.code_abbr[code]))
+
+    # memory mapped copy of the numbers shared by the app's worker processes (see
+    # serve.py).  Each state is a separate df so the data store can drop it.
+    du.write_arena(
+        {"exp_" + du.code_abbr[code]: df_exp, "rev_" + du.code_abbr[code]: df_rev},
+        "local",
+    )
+
+# columnar version of all the exp_rev_XX files in one dataset partitioned by state.
+# (exp and rev have different categories, so they are combined before saving)
+du.write_parquet(
+    pd.concat(local_reports, ignore_index=True).astype(
+        {col: "category" for col in du.LOCAL_CATEGORICALS}
+    ),
+    du.LOCAL_DATASET,
+    partition_cols=du.LOCAL_PARTITIONS,
+)
+
 
 print("get lat lng datfile")
 
 # currently from https://simplemaps.com/data/us-cities.  need better data
-# will do more pre-processing later.  for now done in local.py
+# matched to the local govts below (df_coordinates)
 
 
 df_lat_lng = pd.read_excel(DATA_PREP_PATH.joinpath("uscities.xlsx"))
@@ -452,4 +497,55 @@ with open(DATA_PATH.joinpath("df_lat_lng.pickle"), "wb") as handle:
     pickle.dump((df_lat_lng), handle, protocol=pickle.HIGHEST_PROTOCOL)
 
 
+###################  lat lng of each local govt ################################
+def match_coordinates(df_id, df_lat_lng):
+    """Returns the lat lng of each local govt in df_id.  Govts are matched on the
+    normalized (state, county, name) key, then on (state, name) if only one place in
+    the state has that name.  Places with the same key keep the largest population.
+
+    Returns:
+        df  "id", "ST", "name", "lat", "lng" and "match" ("county", "state" or NaN)
+    """
+    places = df_lat_lng.sort_values("population", ascending=False)
+    places = places.assign(
+        key=du.geo_key(places["state_id"], places["county_name"], places["city"]),
+        state_key=du.geo_key(places["state_id"], None, places["city"]),
+    )
+    county_index = places.drop_duplicates("key").set_index("key")[["lat", "lng"]]
+    state_index = places[~places.duplicated("state_key", keep=False)]
+    state_index = state_index.set_index("state_key")[["lat", "lng"]]
+
+    dff = df_id[["ID code", "ST"]].rename(columns={"ID code": "id"})
+    dff["name"] = df_id["ID name"].str[:-4]
+    key = du.geo_key(dff["ST"], df_id["County name"], dff["name"])
+    state_key = du.geo_key(dff["ST"], None, dff["name"])
+
+    county_match = county_index.reindex(key).set_axis(dff.index)
+    state_match = state_index.reindex(state_key).set_axis(dff.index)
+    dff[["lat", "lng"]] = county_match.fillna(state_match)
+    dff["match"] = np.where(
+        county_match["lat"].notna(),
+        "county",
+        np.where(state_match["lat"].notna(), "state", None),
+    )
+    return dff
+
+
+df_coordinates = match_coordinates(df_id, df_lat_lng)
+
+print("lat lng match rate by Gov Type:")
+print(
+    df_coordinates.groupby(df_coordinates["id"].str[2].map(du.code_type))["match"]
+    .value_counts(normalize=True, dropna=False)
+    .unstack()
+    .round(3)
+)
+print("all govts:", round(df_coordinates["match"].notna().mean(), 3))
+
+df_coordinates = df_coordinates.dropna(subset=["lat"]).reset_index(drop=True)
+with open(DATA_PATH.joinpath("df_coordinates.pickle"), "wb") as handle:
+    pickle.dump((df_coordinates), handle, protocol=pickle.HIGHEST_PROTOCOL)
+du.write_parquet(df_coordinates, "df_coordinates")
+
+
 print("done")
@@ -0,0 +1,211 @@
+"""
+Data access for the app.  Each dataset is loaded once per process by the `store`
+singleton, and the pages (state.py, local.py, state_local.py) all get their data from
+it, so importing more than one page doesn't load the data twice:
+
+    from data_store import store
+
+    df_exp = store.get("df_exp")
+    local_df_exp, local_df_rev = store.get_local("AL")
+    print(store.memory_report())
+
+The dfs are shared by every caller, so they must not be changed in place.
+"""
+
+import collections
+import concurrent.futures
+import os
+import pickle
+import threading
+import time
+
+import pandas as pd
+
+import data_utilities as du
+
+
+# Local data is loaded by state the first time it's needed.  This is the number of
+# states kept in memory - the least recently used state is dropped first.
+# (serve.py sets LOCAL_CACHE_SIZE to keep every state loaded before forking workers)
+LOCAL_CACHE_SIZE = int(os.environ.get("LOCAL_CACHE_SIZE", 12))
+
+
+#####################  Loaders  ##############################################
+
+
+def read_census_pop():
+    """Returns a df of stat population based on census data:
+    https://www.census.gov/data/tables/time-series/demo/popest/2010s-state-total.html
+    """
+
+    df = du.read_excel_cached(
+        du.DATA_PATH.joinpath("nst-est2019-01.xlsx"), skiprows=1, header=2, nrows=56
+    )
+    # remove the regions (states only) and rename state col
+    df_state_pop = df.tail(51).reindex()  # states+DC
+    df_state_pop = df_state_pop.rename(columns={"Unnamed: 0": "State"})
+    ## for some strange reason, the States had a "." at the start
+    df_state_pop["State"] = df_state_pop["State"].str.replace(".", "")
+    return df_state_pop
+
+
+def read_lat_lng():
+    """lat lng of US cities (see data_prep_city)"""
+    with open(du.DATA_PATH.joinpath("df_lat_lng.pickle"), "rb") as handle:
+        return pickle.load(handle)
+
+
+def read_df_exp_rev(ST):
+    """loads the local df_exp and df_rev by state (with the app columns, see
+    du.local_app_schema) from the arena, the columnar data store or the pickle file.
+    """
+    local_df_exp = du.read_arena("local", "exp_" + ST)
+    if local_df_exp is not None:
+        # numeric columns are shared by all the worker processes (see du.write_arena)
+        return local_df_exp, du.read_arena("local", "rev_" + ST)
+
+    local_df_exp = du.read_local(ST, "exp")
+    local_df_rev = du.read_local(ST, "rev")
+    if local_df_exp is None:
+        # columnar data store not built yet - use the pickle file
+        filename = "".join(["exp_rev_", ST, ".pickle"])
+        with open(du.DATA_PATH.joinpath(filename), "rb") as handle:
+            local_df_exp, local_df_rev = pickle.load(handle)
+
+    # files made before data_prep_city saved the app columns, or with "Gov Type" as
+    # text (before it was an int8 code)
+    gov_type = local_df_exp.get("Gov Type")
+    if "Category" not in local_df_exp or not pd.api.types.is_integer_dtype(gov_type):
+        local_df_exp = du.local_app_schema(local_df_exp)
+        local_df_rev = du.local_app_schema(local_df_rev)
+    return local_df_exp, local_df_rev
+
+
+# datasets by name.  df_summary is loaded by data_utilities (it's needed for the
+# app settings) so the store only keeps a reference to it.
+LOADERS = {
+    "df_exp": lambda: du.read_data("df_exp"),
+    "df_rev": lambda: du.read_data("df_rev"),
+    "df_summary": lambda: du.df_summary,
+    "df_pop": read_census_pop,
+    "df_coordinates": lambda: du.read_data("df_coordinates"),
+    "df_lat_lng": read_lat_lng,
+}
+
+
+#####################  Store  ################################################
+
+
+class DataStore:
+    """Loads each dataset once and keeps it for the life of the process.  Local data is
+    kept by state in a least recently used cache.  Loading is thread safe (ie the
+    prewarm thread in local.py and the callbacks).  A state is loaded from disk
+    without holding the lock, so other states (and cache hits) don't wait for it.
+
+    args:
+        loaders (dict)          - {name: function that returns the df}
+        local_cache_size (int)  - max number of states of local data to keep
+    """
+
+    def __init__(self, loaders, local_cache_size=LOCAL_CACHE_SIZE):
+        self.loaders = dict(loaders)
+        self.local_cache_size = local_cache_size
+        self._datasets = {}
+        self._local = collections.OrderedDict()
+        self._local_loading = {}  # {ST: future} for states being loaded
+        self._load_seconds = {}
+        self._lock = threading.RLock()
+
+    def load(self, name):
+        """Loads a dataset (again, if it was loaded already) and returns it.  Errors
+        from the loader (ie FileNotFoundError) are raised and nothing is kept.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            dff = self.loaders[name]()
+            self._datasets[name] = dff
+            self._load_seconds[name] = time.perf_counter() - start
+            return dff
+
+    def get(self, name):
+        """Returns a dataset by name, loading it the first time"""
+        try:
+            return self._datasets[name]
+        except KeyError:
+            with self._lock:
+                if name in self._datasets:
+                    return self._datasets[name]
+                return self.load(name)
+
+    def get_local(self, ST):
+        """Returns the local expenditures and revenue dfs for a state (ie "AL")"""
+        with self._lock:
+            if ST in self._local:
+                self._local.move_to_end(ST)
+                return self._local[ST]
+            future = self._local_loading.get(ST)
+            loading = future is None
+            if loading:
+                future = self._local_loading[ST] = concurrent.futures.Future()
+        if not loading:
+            # another thread is loading this state
+            return future.result()
+
+        try:
+            start = time.perf_counter()
+            frames = read_df_exp_rev(ST)
+        except BaseException as error:
+            with self._lock:
+                del self._local_loading[ST]
+            future.set_exception(error)
+            raise
+
+        with self._lock:
+            self._local[ST] = frames
+            self._load_seconds["local " + ST] = time.perf_counter() - start
+            while len(self._local) > self.local_cache_size:
+                old_ST, _ = self._local.popitem(last=False)
+                self._load_seconds.pop("local " + old_ST, None)
+            del self._local_loading[ST]
+        future.set_result(frames)
+        return frames
+
+    def loaded(self):
+        """names of the loaded datasets ie ["df_exp", "local AL"]"""
+        with self._lock:
+            return list(self._datasets) + ["local " + ST for ST in self._local]
+
+    def clear(self):
+        """drops all the datasets so they are loaded again when they're used"""
+        with self._lock:
+            self._datasets.clear()
+            self._local.clear()
+            self._load_seconds.clear()
+
+    def memory_report(self):
+        """Returns a df with the rows, memory (MB) and load time of each loaded dataset.
+        Columns memory mapped from the arena (see du.write_arena) are included in the
+        memory but are shared by all the processes.
+        """
+        with self._lock:
+            items = list(self._datasets.items()) + [
+                ("local " + ST, frames) for ST, frames in self._local.items()
+            ]
+            load_seconds = dict(self._load_seconds)
+
+        report = []
+        for name, frames in items:
+            frames = frames if isinstance(frames, tuple) else (frames,)
+            report.append(
+                {
+                    "dataset": name,
+                    "rows": sum(len(dff) for dff in frames),
+                    "MB": sum(dff.memory_usage(deep=True).sum() for dff in frames)
+                    / 2 ** 20,
+                    "load seconds": load_seconds.get(name),
+                }
+            )
+        return pd.DataFrame(report, columns=["dataset", "rows", "MB", "load seconds"])
+
+
+store = DataStore(LOADERS)
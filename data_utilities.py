@@ -9,23 +9,297 @@ import dash_core_components as dcc
 import dash_html_components as html
 
 import pandas as pd
+import numpy as np
 import pathlib
+import os
 import pickle
+import shutil
+import collections
+import json
+import hashlib
+import threading
 import colorlover
+import plotly.io as pio
 
 
 PATH = pathlib.Path(__file__).parent
 DATA_PATH = PATH.joinpath("./data").resolve()
 DATA_PREP_PATH = PATH.joinpath("./data_prep_city").resolve()
 
+# Columnar (parquet) version of the data files.  These are written by data_prep.py and
+# data_prep_city.py and load on any python/pandas version, unlike the pickle files.
+PARQUET_PATH = DATA_PATH.joinpath("parquet")
+
+# Read-only, memory mapped copy of the numeric columns (see write_arena).  Worker
+# processes all map the same file, so they share one copy of the numbers.
+ARENA_PATH = DATA_PATH.joinpath("arena")
+ARENA_METRICS = ["Amount", "Per Capita", "Per Student"]
+
+# Binary copies of the Excel input files are saved next to them (see read_excel_cached)
+EXCEL_CACHE_SUFFIX = ".cache.pickle"
+
+# local data is one dataset partitioned by report and state:
+#   data/parquet/local/report=exp/state=AL/...
+# years are columns in this dataset (ie Amount_2017) so a year is selected by column.
+LOCAL_DATASET = "local"
+LOCAL_PARTITIONS = ["report", "state"]
+LOCAL_METRICS = ["Amount", "Per Capita", "Per Student"]
+
+# text columns in the local data with only a few unique values
+LOCAL_CATEGORICALS = ["Category", "Description", "County name"]
+
+
+#####################  Data files  ##########################################
+
+
+def read_excel_cached(filename, **kwargs):
+    """Reads an Excel file like pd.read_excel, and saves the df to a pickle file next
+    to the workbook ie historic.<args hash>.<hash>.cache.pickle.  The args hash is of
+    the read_excel args and the pandas version, and the hash is of the workbook
+    contents too, so a changed spreadsheet is read again and its old cache file (for
+    the same args) is removed.  Reads of the same workbook with other args (ie another
+    sheet_name) have their own cache files.
+
+    args:
+        filename (path)     - the Excel file
+        kwargs              - passed to pd.read_excel ie skiprows=1
+
+    Returns:  df
+    """
+    filename = pathlib.Path(filename)
+    args = repr((sorted(kwargs.items()), pd.__version__)).encode()
+    prefix = filename.stem + "." + hashlib.sha1(args).hexdigest()[:8] + "."
+    digest = hashlib.sha1(filename.read_bytes())
+    digest.update(args)
+    cache = filename.with_name(prefix + digest.hexdigest()[:16] + EXCEL_CACHE_SUFFIX)
+    if cache.exists():
+        with open(cache, "rb") as handle:
+            return pickle.load(handle)
+
+    dff = pd.read_excel(filename, **kwargs)
+    try:
+        for old_cache in filename.parent.glob(prefix + "?" * 16 + EXCEL_CACHE_SUFFIX):
+            if old_cache != cache:
+                old_cache.unlink()
+        # other processes may be reading the cache, so replace it in one step
+        temp = cache.with_name(cache.name + "." + str(os.getpid()))
+        with open(temp, "wb") as handle:
+            pickle.dump(dff, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, cache)
+    except OSError:
+        # ie a read only file system.  The df is still returned.
+        pass
+    return dff
+
+
+def write_parquet(dff, name, partition_cols=None):
+    """Writes a df to the columnar data store in data/parquet.
+
+    args:
+        dff (df)                - dataframe to save
+        name (str)              - file name (or dataset directory name if partitioned)
+        partition_cols [str]    - columns to partition the dataset by
+                                  ie LOCAL_PARTITIONS
+    """
+    PARQUET_PATH.mkdir(exist_ok=True)
+    if partition_cols:
+        # writing a dataset adds files, so remove the old version first
+        shutil.rmtree(PARQUET_PATH.joinpath(name), ignore_errors=True)
+        dff.to_parquet(
+            PARQUET_PATH.joinpath(name), partition_cols=partition_cols, index=False
+        )
+    else:
+        dff.to_parquet(PARQUET_PATH.joinpath(name + ".parquet"), index=False)
+
+
+def arena_column(dff, col):
+    """True if the column is stored in the arena ie a numeric "Amount_2017" column"""
+    return (str(col).rsplit("_", 1)[0] in ARENA_METRICS) and (
+        pd.api.types.is_numeric_dtype(dff[col].dtype)
+    )
+
+
+def write_arena(frames, name):
+    """Saves dfs to a memory mapped arena.  Each df is saved on its own so it can be
+    read (and freed) without the others:  the numeric ARENA_METRICS columns are in a
+    binary file (data/arena/<name>/<key>.arena), one column after another, and the
+    other columns and the layout are in <key>.pickle.  Files for other keys in the
+    arena are kept, so an arena can be written a few dfs at a time.
+
+    args:
+        frames (dict)   - {key: df} ie {"df_exp": df_exp, "df_rev": df_rev}
+        name (str)      - arena name ie "state"
+    """
+    path = ARENA_PATH.joinpath(name)
+    path.mkdir(parents=True, exist_ok=True)
+    for key, dff in frames.items():
+        arena_columns = [col for col in dff.columns if arena_column(dff, col)]
+        blocks = []
+        offset = 0
+        # other processes may have the old file mapped, so replace it in one step
+        temp = path.joinpath(key + ".arena." + str(os.getpid()))
+        with open(temp, "wb") as handle:
+            # one block for each dtype, like pandas, so the blocks are never combined
+            for dtype in dict.fromkeys(str(dff[col].dtype) for col in arena_columns):
+                columns = [col for col in arena_columns if str(dff[col].dtype) == dtype]
+                values = np.ascontiguousarray(dff[columns].to_numpy(dtype=dtype).T)
+                padding = -offset % 64
+                handle.write(b"\0" * padding)
+                offset += padding
+                blocks.append(
+                    {
+                        "columns": columns,
+                        "dtype": dtype,
+                        "shape": values.shape,
+                        "offset": offset,
+                    }
+                )
+                handle.write(values.tobytes())
+                offset += values.nbytes
+        os.replace(temp, path.joinpath(key + ".arena"))
+
+        layout = {"blocks": blocks, "other": dff.drop(columns=arena_columns)}
+        with open(path.joinpath(key + ".pickle"), "wb") as handle:
+            pickle.dump(layout, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_arena(name, key):
+    """Maps a df saved by write_arena.  The numeric columns are read-only views of
+    the file (no copy), so the df must not be changed in place.  They are after the
+    other columns.  Nothing is cached here:  the file is unmapped when the df is no
+    longer used (ie when the data store drops it).
+
+    args:
+        name (str)      - arena name ie "local"
+        key (str)       - df key ie "exp_AL"
+
+    Returns:
+        df, or None if the df isn't in the arena.
+    """
+    filename = ARENA_PATH.joinpath(name, key + ".arena")
+    if not filename.exists():
+        return None
+
+    with open(ARENA_PATH.joinpath(name, key + ".pickle"), "rb") as handle:
+        layout = pickle.load(handle)
+    arena = np.memmap(filename, mode="r") if filename.stat().st_size else None
+
+    other = layout["other"]
+    parts = [other]
+    for block in layout["blocks"]:
+        values = np.ndarray(
+            block["shape"], dtype=block["dtype"], buffer=arena, offset=block["offset"]
+        )
+        parts.append(
+            pd.DataFrame(
+                values.T, columns=block["columns"], index=other.index, copy=False
+            )
+        )
+    return pd.concat(parts, axis=1, copy=False)
+
+
+def read_data(name, columns=None):
+    """Reads a df by name (ie "df_exp") from the "state" arena (see write_arena) or
+    the columnar data store, or from the pickle file in data/ if neither has been built.
+    """
+    dff = read_arena("state", name)
+    if dff is not None:
+        return dff if columns is None else dff[columns]
+
+    filename = PARQUET_PATH.joinpath(name + ".parquet")
+    if filename.exists():
+        import pyarrow.parquet as pq
+
+        dff = pd.read_parquet(filename, columns=columns)
+        # parquet only restores the categorical dtype for text columns (ie "Line")
+        for col in pq.read_schema(filename).pandas_metadata["columns"]:
+            if col["pandas_type"] == "categorical" and col["name"] in dff:
+                dff[col["name"]] = dff[col["name"]].astype("category")
+        return dff
+
+    with open(DATA_PATH.joinpath(name + ".pickle"), "rb") as handle:
+        dff = pickle.load(handle)
+    return dff if columns is None else dff[columns]
+
+
+def read_local(ST, report):
+    """Reads the local expenditure or revenue data for a state from the columnar store.
+    Only the partition for the state is read.  All the columns are read - the data
+    store keeps one copy of each state for all the views, and every metric and year is
+    used by one of them.
+
+    args:
+        ST (str)       - state abbreviation ie "AL"
+        report (str)   - "exp" or "rev"
+
+    Returns:
+        df, or None if the columnar store hasn't been built yet.
+    """
+    dataset_path = PARQUET_PATH.joinpath(LOCAL_DATASET)
+    if not dataset_path.exists():
+        return None
+
+    import pyarrow.parquet as pq
+
+    dataset = pq.ParquetDataset(
+        dataset_path, filters=[("report", "=", report), ("state", "=", ST)]
+    )
+    columns = [col for col in dataset.schema.names if col not in LOCAL_PARTITIONS]
+    return dataset.read(columns=columns).to_pandas()
+
+
 # file that shows which item codes are in each line of the summary report
-with open(DATA_PATH.joinpath("df_summary.pickle"), "rb") as handle:
-    df_summary = pickle.load(handle)
+df_summary = read_data("df_summary")
 
 df_cat_desc = df_summary[["Line", "Category", "Description"]]
 
 line_desc = dict(zip(df_summary.Line, df_summary.Description))
 
+
+def local_app_schema(dff, cat_desc=df_cat_desc):
+    """Returns a local expenditures or revenue df in the shape used by the app:
+    adds the Category and Description of each Line, renames "ID code" to "id" (the
+    row id in dash datatables), makes the LOCAL_CATEGORICALS columns categorical and
+    "Gov Type" an int8 code (position 3 of the ID code, see code_type)
+
+    Files that already have some of the app columns (ie Category) are only converted
+    where they differ.
+
+    args:
+        dff (df)       - local exp or rev data with "ID code" (or "id") and "Line"
+        cat_desc (df)  - Line, Category and Description columns from df_summary
+    """
+    if "Category" not in dff:
+        dff = pd.merge(dff, cat_desc, how="left", on="Line")
+    dff = dff.rename(columns={"ID code": "id"})
+    dff["Gov Type"] = dff["id"].str[2].astype("int8")
+    return dff.astype({col: "category" for col in LOCAL_CATEGORICALS})
+
+
+def normalize_place(names):
+    """Normalizes place names (Series) so the census and lat lng files match: upper
+    case, SAINT is ST, no punctuation and single spaces.  ie "St. Mary's" -> "ST MARYS"
+    """
+    return (
+        names.astype(str)
+        .str.upper()
+        .str.replace(r"\bSAINT\b", "ST", regex=True)
+        .str.replace(r"[^A-Z0-9 ]", "", regex=True)
+        .str.split()
+        .str.join(" ")
+    )
+
+
+def geo_key(states, counties, names):
+    """Key to match local govts with lat lng ie "AL|JEFFERSON|BIRMINGHAM".  counties
+    can be None for a key without the county ie "AL||BIRMINGHAM"
+    """
+    counties = "" if counties is None else normalize_place(counties)
+    return (
+        states.astype(str).str.upper() + "|" + counties + "|" + normalize_place(names)
+    )
+
+
 #####   App init settings:
 INIT_ST = "AL"
 INIT_STATE = "Alabama"
@@ -178,6 +452,18 @@ code_type = {
 
 type_code = dict(map(reversed, code_type.items()))
 
+
+def gov_type_codes(local_type):
+    """Returns the "Gov Type" codes (ints) in the local data for a type dropdown value,
+    ie "c" returns [2, 3] (cities and towns).  Returns None for "all" - no filter.
+    """
+    if (not local_type) or (local_type == "all"):
+        return None
+    if local_type == "c":
+        return [int(type_code["Cities"]), int(type_code["Townships"])]
+    return [int(local_type)]
+
+
 # it's true, 4 is missing
 code_level = {
     "1": "State and Local",
@@ -356,6 +642,109 @@ sunburst_colors = {
 }
 
 
+########### Figure cache
+class FigureCache:
+    """Bounded, least recently used cache of plotly figures.  Figures are saved as JSON
+    so cached figures can't be changed by a callback.  The figures are kept for the
+    life of the process, like the data they are made from (see data_store.py).  Call
+    clear() if the data is loaded again.
+
+    args:
+        maxsize (int)       - max number of figures to keep
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._figures = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, make_figure):
+        """Returns the figure for the key as a dict.  If it's not in the cache,
+        make_figure() is called to create it.
+
+        args:
+            key (tuple)       - all the inputs that the figure depends on
+            make_figure (fn)  - function with no args that returns a figure
+        """
+        with self._lock:
+            figure_json = self._figures.get(key)
+            if figure_json is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._figures.move_to_end(key)
+
+        if figure_json is None:
+            figure_json = pio.to_json(make_figure())
+            with self._lock:
+                self._figures[key] = figure_json
+                if len(self._figures) > self.maxsize:
+                    self._figures.popitem(last=False)
+        return json.loads(figure_json)
+
+    def info(self):
+        """cache statistics, like functools.lru_cache.cache_info()"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "maxsize": self.maxsize,
+            "currsize": len(self._figures),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+
+class ResultCache:
+    """Bounded, least recently used cache of callback results, keyed by a short token
+    for the query.  A callback makes the result once and other callbacks get it with
+    the token, so the data isn't sent to the browser and back.
+
+    args:
+        maxsize (int)   - max number of results to keep
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def token(query):
+        """short token for a query (any JSON data)  ie "5f1d3a9c2b7e4d60" """
+        query_json = json.dumps(query, sort_keys=True, default=str)
+        return hashlib.sha1(query_json.encode()).hexdigest()[:16]
+
+    def get(self, query, make_result):
+        """Returns (token, result) for the query.  If it's not in the cache,
+        make_result() is called to create it.
+        """
+        token = self.token(query)
+        result = self.lookup(token)
+        if result is None:
+            result = make_result()
+            with self._lock:
+                self._results[token] = result
+                if len(self._results) > self.maxsize:
+                    self._results.popitem(last=False)
+        return token, result
+
+    def lookup(self, token):
+        """cached result for a token, or None if it's not in the cache"""
+        with self._lock:
+            result = self._results.get(token)
+            if result is not None:
+                self._results.move_to_end(token)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
 ########### Bar chart
 def make_bar_charts(dff, yaxis_col, xaxis_col, default_color="#446e9b", clip="no"):
 
@@ -402,6 +791,22 @@ def get_col(col_name, year):
     return "".join([col_name, "_", year])
 
 
+def spark_columns(dff, spark_col, spark_yrs):
+    """Returns the sparkline columns ie ["Per Capita_2016", "Per Capita_2017"].  Years
+    missing from dff are added as 0.
+    """
+    spark_cols = ["".join([spark_col, "_", str(year)]) for year in spark_yrs]
+
+    for col in spark_cols:
+        if col not in dff.columns.tolist():
+            dff[col] = 0
+    return spark_cols
+
+
+# sparkline points are ints 0-100, so they are formatted by lookup
+SPARK_POINTS = np.array([str(point) for point in range(101)], dtype=object)
+
+
 def make_sparkline(dff, spark_col, spark_yrs):
     """Makes df column with data formatted for sparkline figure.
 
@@ -414,83 +819,129 @@ def make_sparkline(dff, spark_col, spark_yrs):
               numbers between { } are normalized between 0 and 100
     """
 
-    # select columns for sparkline df
-    spark_cols = ["".join([spark_col, "_", str(year)]) for year in spark_yrs]
-
-    for col in spark_cols:
-        if col not in dff.columns.tolist():
-            dff[col] = 0
-
-    df_spark = dff[spark_cols].copy()
+    spark_cols = spark_columns(dff, spark_col, spark_yrs)
 
     # normalize between 0 and 100  ( (x-x.min)/ (x.max-x.min)*100
-    min = df_spark.min(axis=1)
-    max = df_spark.max(axis=1)
-    df_spark = (
-        df_spark[spark_cols].sub(min, axis="index").div((max - min), axis="index") * 100
+    spark = dff[spark_cols].to_numpy(dtype=float)
+    min = np.fmin.reduce(spark, axis=1)[:, None]
+    max = np.fmax.reduce(spark, axis=1)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spark = (spark - min) / (max - min) * 100
+    spark[np.isnan(spark)] = 0
+    spark = spark.astype(int)
+
+    # putting it all together:  all the rows are formatted a column at a time
+    points = SPARK_POINTS[spark]
+    sparkline = dff[spark_cols[0]].astype(int).astype(str).to_numpy(dtype=object) + "{"
+    sparkline = sparkline + points[:, 0]
+    for col in range(1, len(spark_cols)):
+        sparkline = sparkline + "," + points[:, col]
+    sparkline = (
+        sparkline
+        + "}"
+        + dff[spark_cols[-1]].astype(int).astype(str).to_numpy(dtype=object)
     )
+    return pd.Series(sparkline, index=dff.index, name="sparkline")
 
-    df_spark.fillna(0, inplace=True)
 
-    # putting it all together:
-    df_spark["spark"] = df_spark.astype(int).astype(str).agg(",".join, axis=1)
-    df_spark["start"] = dff[spark_cols[0]].astype(int).astype(str)
-    df_spark["{"] = "{"
-    df_spark["}"] = "}"
-    df_spark["end"] = dff[spark_cols[-1]].astype(int).astype(str)
-    df_spark["sparkline"] = df_spark[["start", "{", "spark", "}", "end"]].agg(
-        "".join, axis=1
-    )
-    return df_spark["sparkline"]
+def add_sparklines(
+    dff, spark_cols=("Per Capita", "Per Student"), spark_yrs=LOCAL_YEARS
+):
+    """Adds precomputed "sparkline_Per Capita" and "sparkline_Per Student" columns to
+    the local data (one sparkline per entity and Line).  Missing years are 0 - the same
+    as in a subtotal of the row.  See local.subtotal()
+    """
+    for spark_col in spark_cols:
+        year_cols = [get_col(spark_col, year) for year in spark_yrs]
+        year_cols = [col for col in year_cols if col in dff]
+        dff["".join(["sparkline_", spark_col])] = make_sparkline(
+            dff[year_cols].fillna(0), spark_col, spark_yrs
+        )
+    return dff
 
 
-def discrete_background_color_bins(df, n_bins=5, columns="all"):
+def color_bins(df, n_bins=5, columns="all"):
+    """Bins the numeric columns for the table background colors.  The bin edges are
+    computed once for all the columns: n_bins equal ranges between the min and max
+    after removing outliers (values >= the 0.99 quantile).  Bins include the lower edge
+    and the last bin includes everything above its lower edge (ie the outliers).
 
-    bounds = [i * (1.0 / n_bins) for i in range(n_bins + 1)]
+    Returns:
+        ranges  list of the n_bins + 1 bin edges, or None if there are no bins (ie all
+                the values are the same)
+        df      "<column>_bin" int8 columns:  1 to n_bins, or 0 for no bin (ie NaN)
+    """
     if columns == "all":
         if "id" in df:
             df_numeric_columns = df.select_dtypes("number").drop(["id"], axis=1)
         else:
             df_numeric_columns = df.select_dtypes("number")
+        df_numeric_columns = df_numeric_columns.loc[
+            :, ~df_numeric_columns.columns.str.endswith("_bin")
+        ]
     else:
         df_numeric_columns = df[columns]
+    values = df_numeric_columns.to_numpy(dtype=float)
 
     # removes outliers
-    x = df_numeric_columns.copy()
-    x = x[x < x.quantile(0.99)]
+    x = df_numeric_columns.where(df_numeric_columns < df_numeric_columns.quantile(0.99))
 
     df_max = x.max().max()
     df_min = x.min().min()
 
+    bounds = [i * (1.0 / n_bins) for i in range(n_bins + 1)]
     ranges = [((df_max - df_min) * i) + df_min for i in bounds]
+    bin_columns = [column + "_bin" for column in df_numeric_columns]
+    if not df_max > df_min:
+        return None, pd.DataFrame(0, index=df.index, columns=bin_columns, dtype="int8")
+
+    bins = np.digitize(values, ranges[1:-1]) + 1
+    bins[np.isnan(values) | (values < ranges[0])] = 0
+    return ranges, pd.DataFrame(
+        bins.astype("int8"), index=df.index, columns=bin_columns
+    )
+
+
+def bin_colors(bins, n_bins=5):
+    """Colors for a "<column>_bin" column (see color_bins).  Bin 0 is NaN"""
+    colors = colorlover.scales[str(n_bins)]["seq"]["Blues"]
+    colors = np.array([np.nan] + colors[:n_bins], dtype=object)
+    return pd.Series(colors[bins.to_numpy()], index=bins.index)
+
+
+def discrete_background_color_bins(ranges, df_bins, n_bins=5):
+    """Table background colors and legend for the bins made by color_bins.  The styles
+    match the "<column>_bin" columns, so they must be in the table data.
 
+    args:
+        ranges      - bin edges from color_bins (None if there are no bins)
+        df_bins     - "<column>_bin" columns from color_bins
+        n_bins      - number of bins used in color_bins
+
+    Returns:
+        styles   style_data_conditional for the table - one rule per bin and column
+        legend   html.Div legend with the lower edge of each bin
+        df       "<column>_color" columns with the color for each row, NaN for no bin
+        df_max   upper edge of the bins
+    """
+    if ranges is None:
+        return [], [], pd.DataFrame(), 0
+
+    colors = colorlover.scales[str(n_bins)]["seq"]["Blues"]
     styles = []
     legend = []
-    colors = []
-    dff = pd.DataFrame()
-    for i in range(1, len(bounds)):
-        min_bound = ranges[i - 1]
-        max_bound = ranges[i]
-        backgroundColor = colorlover.scales[str(n_bins)]["seq"]["Blues"][i - 1]
-        color = "white" if i > len(bounds) / 2.0 else "inherit"
-        colors.append(backgroundColor)
-        for column in df_numeric_columns:
+    for i in range(1, n_bins + 1):
+        color = "white" if i > (n_bins + 1) / 2.0 else "inherit"
+        for bin_column in df_bins:
             styles.append(
                 {
                     "if": {
-                        "filter_query": (
-                            "{{{column}}} >= {min_bound}"
-                            + (
-                                " && {{{column}}} < {max_bound}"
-                                if (i < len(bounds) - 1)
-                                else ""
-                            )
-                        ).format(
-                            column=column, min_bound=min_bound, max_bound=max_bound
+                        "filter_query": "{{{bin_column}}} = {i}".format(
+                            bin_column=bin_column, i=i
                         ),
-                        "column_id": column,
+                        "column_id": bin_column[: -len("_bin")],
                     },
-                    "backgroundColor": backgroundColor,
+                    "backgroundColor": colors[i - 1],
                     "color": color,
                 }
             )
@@ -500,26 +951,25 @@ def discrete_background_color_bins(df, n_bins=5, columns="all"):
                 children=[
                     html.Div(
                         style={
-                            "backgroundColor": backgroundColor,
+                            "backgroundColor": colors[i - 1],
                             "borderLeft": "1px rgb(50, 50, 50) solid",
                             "height": "10px",
                         }
                     ),
-                    html.Small(round(min_bound, 0), style={"paddingLeft": "2px"}),
+                    html.Small(round(ranges[i - 1], 0), style={"paddingLeft": "2px"}),
                 ],
             )
         )
 
-    for column in df_numeric_columns:
-        try:
-            dff[column + "_color"] = pd.cut(
-                df_numeric_columns[column],
-                bins=ranges,
-                labels=colors,
-                duplicates="drop",
-            )
-        except:
-            return [], [], pd.DataFrame(), 0
+    dff = pd.DataFrame(
+        {
+            bin_column[: -len("_bin")]
+            + "_color": bin_colors(df_bins[bin_column], n_bins)
+            for bin_column in df_bins
+        },
+        index=df_bins.index,
+    )
+    df_max = ranges[-1]
 
     return (
         styles,
@@ -5,18 +5,22 @@ import dash_table.FormatTemplate as FormatTemplate
 from dash_table.Format import Format, Group
 
 import dash_html_components as html
+import dash_core_components as dcc
 from dash.exceptions import PreventUpdate
 
 import dash_bootstrap_components as dbc
 import pandas as pd
+import numpy as np
 import pathlib
-import pickle
+import functools
+import threading
 import colorlover
 import dash_leaflet as dl
 import dash_leaflet.express as dlx
 
 from app import app
 import data_utilities as du
+from data_store import store
 
 
 pd.set_option("display.max_rows", 100)
@@ -27,44 +31,117 @@ PATH = pathlib.Path(__file__).parent
 DATA_PATH = PATH.joinpath("./data").resolve()
 
 
-with open(DATA_PATH.joinpath("df_lat_lng.pickle"), "rb") as handle:
-    df_lat_lng = pickle.load(handle)
+# lat lng of each local govt, matched in data_prep_city.  Data files made before that
+# only have df_lat_lng, which is matched to the govts when a state is loaded.
+try:
+    df_coordinates = store.get("df_coordinates")
+except FileNotFoundError:
+    df_coordinates = None
+    df_lat_lng = store.get("df_lat_lng")
+
+
+# number of states of local data kept in memory (see data_store.LOCAL_CACHE_SIZE)
+LOCAL_CACHE_SIZE = store.local_cache_size
+
+# local map GeoBuf layers kept in memory - one for each state, report and filter
+MAP_CACHE_SIZE = 64
+# local table results kept in memory (see get_table_result) and rows per table page
+TABLE_CACHE_SIZE = 64
+PAGE_SIZE = 50
+
+# local_query keys that select the map layer (all but the year)
+MAP_QUERY_KEYS = ["ST", "exp_or_rev", "local_type", "cat", "subcat", "county", "name"]
+
+# states loaded in a background thread at startup so the first page view is fast
+PREWARM_STATES = [du.INIT_ST]
 
 
 # Local  Expenditures and Revenue df
 def get_df_exp_rev(ST):
-    """ loads the df_exp and df_rev files by state and adds Cat and Descr columns"""
-    filename = "".join(["exp_rev_", ST, ".pickle"])
-    with open(DATA_PATH.joinpath(filename), "rb") as handle:
-        local_df_exp, local_df_rev = pickle.load(handle)
+    """loads the df_exp and df_rev files by state (with Cat and Descr columns).
+    The dfs are kept in the data store - callers must not modify them in place.
+    """
+    return store.get_local(ST)
 
-    local_df_exp = pd.merge(local_df_exp, du.df_cat_desc, how="left", on="Line")
-    local_df_rev = pd.merge(local_df_rev, du.df_cat_desc, how="left", on="Line")
 
-    ### TODO move add lat long to data prep?
-    # local_df_exp = pd.merge(local_df_exp, df_lat_lng, how='left', left_on=['County name', 'ID name'],  right_on =['county_name', 'city'])
-    # local_df_exp['lat'] = local_df_exp['lat'].fillna(0)
-    #
-    # local_df_rev = pd.merge(local_df_rev, df_lat_lng, how='left', left_on=['County name', 'ID name'],
-    #                        right_on=['county_name', 'city'])
-    # local_df_rev['lat'] = local_df_rev['lat'].fillna(0)
+def get_local_df(ST, exp_or_rev="Expenditures"):
+    """ returns the local expenditures or revenue df for a state (ie "AL") """
+    local_df_exp, local_df_rev = get_df_exp_rev(ST)
+    return local_df_rev if exp_or_rev == "Revenue" else local_df_exp
 
-    ### TODO move rename to data prep
-    # this makes "ID code" the "id" for the dash datatable functions
-    local_df_exp = local_df_exp.rename(columns={"ID code": "id"})
-    local_df_rev = local_df_rev.rename(columns={"ID code": "id"})
-    return local_df_exp, local_df_rev
 
+def prewarm_local(states=None, background=True):
+    """Loads the local data for states before a callback asks for it.
 
-# initialize Local
+    args:
+        states [str]      - state abbreviations to load.  Default is all states, but
+                            only the last LOCAL_CACHE_SIZE states stay in the cache.
+        background (bool) - if True, loads in a daemon thread and returns the thread
+    """
+    states = list(du.abbr_state_noUS) if states is None else states
+
+    def load():
+        for ST in states:
+            get_df_exp_rev(ST)
+
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load, name="prewarm_local", daemon=True)
+    thread.start()
+    return thread
 
 
-rev = {}
-exp = {}
-for STATE in du.abbr_state_noUS:
-    exp[STATE], rev[STATE] = get_df_exp_rev(STATE)
-init_local_df_exp = exp[du.INIT_ST]
-init_local_df_rev = rev[du.INIT_ST]
+# initialize Local
+prewarm_thread = prewarm_local(PREWARM_STATES)
+
+
+#####################  Local filters  ########################################
+
+# columns of the local data that can be filtered with the dropdowns
+FILTER_COLUMNS = ["Gov Type", "Category", "Description", "County name", "ID name"]
+
+
+@functools.lru_cache(maxsize=2 * LOCAL_CACHE_SIZE)
+def get_filter_index(ST, exp_or_rev):
+    """Row positions in the local df for each value of the FILTER_COLUMNS.  For
+    example index["County name"]["Jefferson"] is a sorted array of the positions of
+    the Jefferson County rows.
+    """
+    dff = get_local_df(ST, exp_or_rev)
+    return {
+        col: dff.groupby(col, observed=True, sort=False).indices
+        for col in FILTER_COLUMNS
+    }
+
+
+def filter_local(ST, exp_or_rev, filters):
+    """Selects the rows of the local df that match all the filters.  Each filter is
+    resolved with the filter index, and the row positions are intersected so the df
+    is only sliced once.
+
+    args:
+        ST (str)          - state abbreviation ie "AL"
+        exp_or_rev (str)  - "Expenditures" or "Revenue"
+        filters (dict)    - {column: [values]}  Rows match if the column is any of
+                            the values.  ie {"Gov Type": [2, 3], "Category": ["Other"]}
+    """
+    exp_or_rev = "Revenue" if exp_or_rev == "Revenue" else "Expenditures"
+    dff = get_local_df(ST, exp_or_rev)
+    if not filters:
+        return dff
+
+    index = get_filter_index(ST, exp_or_rev)
+    positions = None
+    for col, values in filters.items():
+        rows = [index[col][value] for value in values if value in index[col]]
+        rows = np.sort(np.concatenate(rows)) if rows else np.array([], dtype=np.intp)
+        positions = (
+            rows
+            if positions is None
+            else np.intersect1d(positions, rows, assume_unique=True)
+        )
+    return dff.take(positions)
 
 
 # initialize State
@@ -83,6 +160,113 @@ def year_filter(dff, year):
     )
 
 
+def subtotal(dff, columns):
+    """Sums the Amount, Per Capita and Per Student columns (all years) by the columns
+    selected. Rows are sorted by the selected columns - groupby doesn't sort the
+    categorical columns when observed=True.
+
+    Sparklines precomputed in the data files (see du.add_sparklines) are kept when each
+    subtotal is a single row.
+    """
+    metrics = [col for col in dff.columns if col.rsplit("_", 1)[0] in du.LOCAL_METRICS]
+    sparklines = [col for col in dff.columns if col.startswith("sparkline_")]
+    grouped = dff.groupby(columns, observed=True)
+    dff_subtotal = grouped[metrics].sum()
+    if sparklines and (len(dff_subtotal) == len(dff)):
+        dff_subtotal[sparklines] = grouped[sparklines].first()
+    return dff_subtotal.sort_index().reset_index()
+
+
+def table_sparkline(dff, spark_col, precomputed):
+    """Returns the sparkline column for the local table: the precomputed one if subtotal
+    kept it, otherwise du.make_sparkline()
+
+    args:
+        dff (df)          - subtotaled local table
+        spark_col (str)   - "Per Capita" or "Per Student"
+        precomputed (df)  - sparkline columns from the data files (may be empty)
+    """
+    sparkline = "".join(["sparkline_", spark_col])
+    if sparkline not in precomputed:
+        return du.make_sparkline(dff, spark_col, du.LOCAL_YEARS)
+    # empty years are added to the table the same as make_sparkline
+    du.spark_columns(dff, spark_col, du.LOCAL_YEARS)
+    return precomputed[sparkline]
+
+
+def table_color_column(dff):
+    """ column used for the table background colors, bar charts and map"""
+    if "Per Capita" in dff:
+        return "Per Capita"
+    elif "Per Student" in dff:
+        return "Per Student"
+    return "Amount"
+
+
+def local_filters(local_type, cat, subcat, county, name):
+    """ filter_local() filters for the local table dropdowns"""
+    filters = {}
+    if local_type and (local_type != "all"):
+        filters["Gov Type"] = du.gov_type_codes(local_type)
+    if cat and (cat != "all"):
+        filters["Category"] = [cat]
+    if subcat and (subcat != "all"):
+        filters["Description"] = [subcat]
+    if county and (county != "all"):
+        filters["County name"] = [county]
+    if name and (name != "all"):
+        filters["ID name"] = [name]
+    return filters
+
+
+def local_table(ST, exp_or_rev, local_type, cat, subcat, county, name):
+    """Returns the local table for the dropdowns, all years: each government's
+    subtotal for the category and subcategory selected
+    """
+    filters = local_filters(local_type, cat, subcat, county, name)
+    dff = filter_local(ST, exp_or_rev, filters)
+    main_columns = ["ST", "id", "County name", "ID name", "Gov Type"]
+    if subcat:
+        return subtotal(dff, main_columns + ["Category", "Description"])
+    elif cat:
+        return subtotal(dff, main_columns + ["Category"])
+    return subtotal(dff, main_columns)
+
+
+@functools.lru_cache(maxsize=LOCAL_CACHE_SIZE)
+def get_coordinates(ST):
+    """lat and lng of the local governments in a state"""
+    if df_coordinates is not None:
+        return df_coordinates.loc[
+            df_coordinates["ST"] == ST, ["id", "name", "lat", "lng"]
+        ].reset_index(drop=True)
+
+    dff = get_local_df(ST)[["id", "County name", "ID name"]].drop_duplicates("id")
+    dff["name"] = dff["ID name"].str[:-4]
+    dff = pd.merge(
+        dff,
+        df_lat_lng[df_lat_lng["state_id"] == ST],
+        how="left",
+        left_on=["County name", "name"],
+        right_on=["county_name", "city"],
+    )
+    return dff[["id", "name", "lat", "lng"]].dropna()
+
+
+@functools.lru_cache(maxsize=MAP_CACHE_SIZE)
+def get_map_geobuf(ST, exp_or_rev, local_type, cat, subcat, county, name):
+    """GeoBuf layer for the local map with every metric for every year, so a year
+    change only needs a new hideout color_prop.  The popups are made in the browser
+    (see assets/leaflet.js).  Args are the same as local_table()
+    """
+    dff = local_table(ST, exp_or_rev, local_type, cat, subcat, county, name)
+    dff = dff.drop(columns=dff.filter(like="sparkline_").columns)
+    dff = pd.merge(dff, get_coordinates(ST), on="id")
+    dff["tooltip"] = dff["name"]
+    geojson_data = dlx.dicts_to_geojson(dff.to_dict("records"), lon="lng")
+    return dlx.geojson_to_geobuf(geojson_data)
+
+
 # leaflet map: Create geojson.
 
 attribution = 'Map tiles by <a href="http://stamen.com">Stamen Design</a>, ' \
@@ -192,20 +376,34 @@ perstudent_columns = [
 
 local_datatable = html.Div(
     [
+        # the dropdowns for the local table - used to make the map (see get_map_geobuf)
+        dcc.Store(id="local_query"),
+        # the table only has the current page, so the whole table is downloaded from
+        # the server (see download_local_table)
+        dbc.Button(
+            "Export",
+            id="local_download_button",
+            color="light",
+            size="sm",
+            className="mb-1",
+        ),
+        dcc.Download(id="local_download"),
         dash_table.DataTable(
             id="local_table",
             columns=local_columns + percapita_columns,
             merge_duplicate_headers=True,
             # data=init_local_df_exp.to_dict("records"),
             # filter_action='native',
-            sort_action="native",
-            export_format="xlsx",
-            export_headers="display",
+            # paged and sorted on the server (see get_table_result)
+            page_action="custom",
+            sort_action="custom",
+            sort_mode="single",
+            page_current=0,
             row_selectable="single",
             # row_deletable = True,
             is_focused=False,
             cell_selectable=False,
-            page_size=50,
+            page_size=PAGE_SIZE,
             style_table={
                 "overflowY": "scroll",
                 "border": "thin lightgrey solid",
@@ -272,7 +470,7 @@ def update_counties(state):
         state = du.INIT_STATE
     options = [{"label": "All Counties", "value": "all"}] + [
         {"label": c, "value": c}
-        for c in exp[du.state_abbr[state]]["County name"]
+        for c in get_local_df(du.state_abbr[state])["County name"]
         .sort_values()
         .dropna()
         .unique()
@@ -298,18 +496,8 @@ def update_counties(
     if state == "USA":
         state = "Alabama"
 
-    dff = exp[du.state_abbr[state]].copy()
-
-    if local_type and (local_type != "all"):
-        if local_type == "c":
-            dff = dff[
-                dff["Gov Type"].str.contains("2", na=False)
-                | dff["Gov Type"].str.contains("3", na=False)
-            ]
-        else:
-            dff = dff[dff["Gov Type"].str.contains(local_type, na=False)]
-    if county and (county != "all"):
-        dff = dff[dff["County name"] == county]
+    filters = local_filters(local_type, None, None, county, None)
+    dff = filter_local(du.state_abbr[state], "Expenditures", filters)
 
     return [{"label": "All Cities", "value": "all"}] + [
         {"label": name, "value": name}
@@ -321,110 +509,232 @@ def update_counties(
 
 
 #####  Update local table
-@app.callback(
-    [
-        Output("local_table", "data"),
-        Output("local_table", "columns"),
-        Output("local_title", "children"),
-        Output("collapse", "is_open"),
-    ],
-    [
-        Input("store_exp_or_rev", "data"),
-        Input("year", "value"),
-        Input("category_dropdown", "value"),
-        Input("subcategory_dropdown", "value"),
-        Input("state", "value"),
-        Input("local_type", "value"),
-        Input("local_county_dropdown", "value"),
-        Input("local_name_dropdown", "value"),
-    ],
-    # prevent_initial_call=True,
-)
-def update_local_table(exp_or_rev, year, cat, subcat, state, type, county, name):
-
-    ctx = dash.callback_context
-    input_id = ctx.triggered[0]["prop_id"].split(".")[0]
-
-    if state == "USA":
-        state = "Alabama"
-    if year < int(min(du.LOCAL_YEARS)):
-        year = int(du.LOCAL_YEARS)
-
+table_cache = du.ResultCache(maxsize=TABLE_CACHE_SIZE)
+
+
+def get_table_result(query):
+    """Returns (token, result) for a local_query from the table cache.  The result is
+    made again if the token isn't in the cache (ie it was dropped).  Callers must not
+    modify the result.
+    """
+    token = query.get("token")
+    result = table_cache.lookup(token) if token else None
+    if result is None:
+        token, result = table_cache.get(
+            query["table"], lambda: make_table_result(*query["table"])
+        )
+    return token, result
+
+
+def make_table_result(exp_or_rev, year, cat, subcat, state, local_type, county, name):
+    """Makes the local table for the dropdowns.  Results are cached (see
+    get_table_result), so paging and sorting the table only selects rows.
+
+    Returns:
+        None if the table is empty, otherwise a dict:
+        "df"       - all the table rows, only the columns sent to the table
+        "columns"  - DataTable columns
+        "title"    - table title
+        "query"    - local_query data: the map layer (see get_map_geobuf), year and
+                     the make_table_result args ("table")
+        "color_ranges" - bin edges of the "<column>_bin" color column, None if
+                         there are no bins (see du.color_bins)
+        "order"    - sorted row positions, filled in by table_order()
+    """
     title = " ".join([str(year), state, exp_or_rev])
     update_title = title
 
-    df_table = (
-        rev[du.state_abbr[state]]
-        if exp_or_rev == "Revenue"
-        else exp[du.state_abbr[state]]
-    )
-
-    # filter  table
-    if type and (type != "all"):
-        if type == "c":
-            df_table = df_table[
-                df_table["Gov Type"].str.contains("2", na=False)
-                | df_table["Gov Type"].str.contains("3", na=False)
-            ].copy()
-        else:
-            df_table = df_table[df_table["Gov Type"].str.contains(type, na=False)]
-        update_title = " ".join([title, " --> ", du.code_type[type]])
+    if local_type and (local_type != "all"):
+        update_title = " ".join([title, " --> ", du.code_type[local_type]])
     if cat and (cat != "all"):
-        df_table = df_table[df_table["Category"] == cat]
         title = " ".join([update_title, "-->", cat])
     if subcat and (subcat != "all"):
-        df_table = df_table[df_table["Description"] == subcat]
         title = " ".join([title, "-->", subcat])
     if county and (county != "all"):
-        df_table = df_table[df_table["County name"] == county]
         update_title = " ".join([title, county, " county"])
-    if name and (name != "all"):
-        df_table = df_table[df_table["ID name"] == name]
 
-    # subtotal table
-    main_columns = ["ST", "id", "County name", "ID name", "Gov Type"]
-    if subcat:
-        df_table = (
-            df_table.groupby(main_columns + ["Category", "Description"])
-            .sum()
-            .reset_index()
-        )
-    elif cat:
-        df_table = df_table.groupby(main_columns + ["Category"]).sum().reset_index()
-    else:
-        df_table = df_table.groupby(main_columns).sum().reset_index()
+    # filter and subtotal table
+    query = {
+        "ST": du.state_abbr[state],
+        "exp_or_rev": exp_or_rev,
+        "local_type": local_type,
+        "cat": cat,
+        "subcat": subcat,
+        "county": county,
+        "name": name,
+    }
+    df_table = local_table(**query)
 
     # remove empty cols
     df_table = df_table.loc[:, (df_table != 0).any(axis=0)]
+    sparklines = df_table.filter(like="sparkline_")
+    df_table = df_table.drop(columns=sparklines.columns)
 
     if df_table.empty:
-        return [], [], [], True
+        return None
 
     # school district columns
-    if (df_table["Gov Type"] == "5").all():
+    if (df_table["Gov Type"] == 5).all():
         columns = local_columns + perstudent_columns
-        df_table["sparkline_Per Student"] = du.make_sparkline(
-            df_table, "Per Student", du.LOCAL_YEARS
+        df_table["sparkline_Per Student"] = table_sparkline(
+            df_table, "Per Student", sparklines
         )
         df_table = year_filter(df_table, str(year))
         df_table["Enrollment"] = df_table["Amount"] / df_table["Per Student"]
         update_title = " ".join([update_title, du.code_type["5"]])
 
     # special districts columns
-    elif (df_table["Gov Type"] == "4").all():
+    elif (df_table["Gov Type"] == 4).all():
         columns = local_columns
         df_table = year_filter(df_table, str(year))
         update_title = " ".join([update_title, du.code_type["4"]])
     else:
         # LOCAL columns
         columns = local_columns + percapita_columns
-        df_table["sparkline_Per Capita"] = du.make_sparkline(
-            df_table, "Per Capita", du.LOCAL_YEARS
+        df_table["sparkline_Per Capita"] = table_sparkline(
+            df_table, "Per Capita", sparklines
         )
         df_table = year_filter(df_table, str(year))
         df_table["Population"] = df_table["Amount"] / df_table["Per Capita"]
 
-    return df_table.to_dict("records"), columns, update_title, False
+    # color bins for the table background (see the local styles callback)
+    color_ranges = None
+    if table_color_column(df_table) in df_table:
+        color_ranges, df_bins = du.color_bins(
+            df_table, columns=[table_color_column(df_table)]
+        )
+        df_table = df_table.join(df_bins)
+
+    # only the table columns are sent, not the other years
+    table_columns = [col["id"] for col in columns] + ["id"]
+    table_columns += [col for col in df_table if col.endswith("_bin")]
+    df_table = df_table[[col for col in table_columns if col in df_table]]
+
+    query["year"] = str(year)
+    query["table"] = [exp_or_rev, year, cat, subcat, state, local_type, county, name]
+    return {
+        "df": df_table,
+        "columns": columns,
+        "title": update_title,
+        "query": query,
+        "color_ranges": color_ranges,
+        "order": {},
+    }
+
+
+def table_order(result, column_id, direction):
+    """Row positions of the table sorted by a column.  These are saved in the result, so
+    each column is sorted once.
+    """
+    key = (column_id, direction)
+    if key not in result["order"]:
+        result["order"][key] = (
+            result["df"][column_id]
+            .reset_index(drop=True)
+            .sort_values(ascending=(direction == "asc"), kind="mergesort")
+            .index.to_numpy()
+        )
+    return result["order"][key]
+
+
+def table_page(result, page_current, sort_by):
+    """Row positions of the table page to send to the browser"""
+    positions = np.arange(len(result["df"]))
+    if sort_by and (sort_by[0]["column_id"] in result["df"]):
+        column_id, direction = sort_by[0]["column_id"], sort_by[0]["direction"]
+        positions = table_order(result, column_id, direction)
+    start = (page_current or 0) * PAGE_SIZE
+    return positions[start : start + PAGE_SIZE]
+
+
+@app.callback(
+    [
+        Output("local_table", "data"),
+        Output("local_table", "columns"),
+        Output("local_title", "children"),
+        Output("collapse", "is_open"),
+        Output("local_query", "data"),
+        Output("local_table", "page_count"),
+        Output("local_table", "page_current"),
+    ],
+    [
+        Input("store_exp_or_rev", "data"),
+        Input("year", "value"),
+        Input("category_dropdown", "value"),
+        Input("subcategory_dropdown", "value"),
+        Input("state", "value"),
+        Input("local_type", "value"),
+        Input("local_county_dropdown", "value"),
+        Input("local_name_dropdown", "value"),
+        Input("local_table", "page_current"),
+        Input("local_table", "sort_by"),
+    ],
+    # prevent_initial_call=True,
+)
+def update_local_table(
+    exp_or_rev, year, cat, subcat, state, type, county, name, page_current, sort_by
+):
+
+    ctx = dash.callback_context
+
+    # a new table or a new sort starts on the first page.  Paging only selects rows.
+    if ctx.triggered[0]["prop_id"] != "local_table.page_current":
+        page_current = 0
+
+    if state == "USA":
+        state = "Alabama"
+    if year < int(min(du.LOCAL_YEARS)):
+        year = int(du.LOCAL_YEARS)
+
+    table = [exp_or_rev, year, cat, subcat, state, type, county, name]
+    token, result = get_table_result({"table": table})
+    if result is None:
+        return [], [], [], True, None, 0, 0
+
+    page_count = max(1, -(-len(result["df"]) // PAGE_SIZE))
+    page_current = min(page_current or 0, page_count - 1)
+    df_page = result["df"].iloc[table_page(result, page_current, sort_by)]
+    return (
+        df_page.to_dict("records"),
+        result["columns"],
+        result["title"],
+        False,
+        dict(result["query"], token=token),
+        page_count,
+        page_current,
+    )
+
+
+def table_export(result, sort_by):
+    """All the rows of the table, sorted like the table, with the display headers"""
+    dff = result["df"]
+    if sort_by and (sort_by[0]["column_id"] in dff):
+        column_id, direction = sort_by[0]["column_id"], sort_by[0]["direction"]
+        dff = dff.iloc[table_order(result, column_id, direction)]
+
+    headers = {}
+    for col in result["columns"]:
+        if col["id"] in dff:
+            # merged headers are lists ie [" ", "County"]
+            name = col["name"] if isinstance(col["name"], list) else [col["name"]]
+            headers[col["id"]] = " ".join(part.strip() for part in name if part.strip())
+    return dff[list(headers)].rename(columns=headers)
+
+
+@app.callback(
+    Output("local_download", "data"),
+    [Input("local_download_button", "n_clicks")],
+    [State("local_query", "data"), State("local_table", "sort_by")],
+    prevent_initial_call=True,
+)
+def download_local_table(n_clicks, query, sort_by):
+    if not query:
+        raise PreventUpdate
+    _, result = get_table_result(query)
+    if result is None:
+        raise PreventUpdate
+    dff = table_export(result, sort_by)
+    return dcc.send_data_frame(dff.to_excel, "local_table.xlsx", index=False)
 
 
 @app.callback(
@@ -454,15 +764,21 @@ def render_map(at, children):
     ],
     [
         Input("tabs", "active_tab"),
-        Input("local_table", "derived_virtual_data"),
+        Input("local_query", "data"),
         Input("local_table", "derived_viewport_row_ids"),
         Input("local_table", "derived_virtual_selected_row_ids"),
     ],
-    [State("local_table", "data"), State("local_map", "children")],
+    [
+        State("local_table", "page_current"),
+        State("local_table", "sort_by"),
+        State("geojson", "hideout"),
+    ],
      #prevent_initial_call=True,
 )
-def update_local_table(at, data, viewport_ids, selected_row_id, data_state, local_map):
-    # TODO don't pass entire map.  just need to see if it exists
+def update_local_table(
+    at, query, viewport_ids, selected_row_id, page_current, sort_by, hideout
+):
+    # The table is in the server side cache - the query has its token
     print('test1')
     if (not at) or (at != "local_tab"):
         raise PreventUpdate
@@ -470,19 +786,16 @@ def update_local_table(at, data, viewport_ids, selected_row_id, data_state, loca
     ctx = dash.callback_context
     input_id = ctx.triggered[0]["prop_id"].split(".")[0]
 
-    dff = pd.DataFrame(data)
-    if dff.empty:
+    if not query:
         return [], [], [], None, None, {}
     else:
-        if "Per Capita" in dff:
-            color_column = "Per Capita"
-        elif "Per Student" in dff:
-            color_column = "Per Student"
-        else:
-            color_column = "Amount"
-
+        # the colors are for the whole table, not just the page.  The bins were made
+        # with the table (see make_table_result)
+        token, result = get_table_result(query)
+        df_table = result["df"]
+        color_column = table_color_column(df_table)
         (styles, legend, df_color, max_y) = du.discrete_background_color_bins(
-            dff, columns=[color_column]
+            result["color_ranges"], df_table.filter([color_column + "_bin"])
         )
 
         styles = styles + [
@@ -498,60 +811,40 @@ def update_local_table(at, data, viewport_ids, selected_row_id, data_state, loca
         ]
 
         bar_charts = []
-        if (not df_color.empty) and (len(dff["id"].unique()) > 1):
-            dff[color_column + "_color"] = df_color
-            dff = dff[dff["id"].isin(viewport_ids)]
+        if (not df_color.empty) and (len(df_table["id"].unique()) > 1):
+            dff = df_table.iloc[table_page(result, page_current, sort_by)]
+            colors = {color_column + "_color": df_color[color_column + "_color"]}
+            dff = dff.assign(**colors)
             bar_charts = du.make_bar_charts(dff, color_column, "ID name", clip=max_y)
 
-        # update map
-        dff_state = pd.DataFrame(data_state)
-        dff_lat_lng = df_lat_lng[df_lat_lng["state_id"] == dff_state["ST"].iat[0]]
-
-        dff_state["name"] = dff_state["ID name"].str[:-4]
-        dff_state = pd.merge(
-            dff_state,
-            dff_lat_lng,
-            how="left",
-            left_on=["County name", "name"],
-            right_on=["county_name", "city"],
-        )
-        dff_state = dff_state.dropna()
-
-        dicts = dff_state.to_dict("row")
-        for item in dicts:
-            item["popup"] = "${:.0f} per capita    {}".format(
-                item[color_column], item["name"]
-            )
-            item["tooltip"] = item["name"]  # bind popup
-        geojson_data = dlx.dicts_to_geojson(dicts, lon="lng")  # convert to geojson
-        geobuf = dlx.geojson_to_geobuf(geojson_data)  # convert to geobuf
+        # update map: the layer is only sent when the query changes, a year change
+        # only updates the hideout color_prop
+        ST = query["ST"]
+        layer = [query[key] for key in MAP_QUERY_KEYS]
+        if (hideout or {}).get("layer") == layer:
+            geobuf = dash.no_update
+        else:
+            geobuf = get_map_geobuf(*layer)
 
         colors = colorlover.scales[str(5)]["seq"]["Blues"]
         hideout = dict(
             colorscale=colors,
-            color_prop=color_column,
+            color_prop=du.get_col(color_column, query["year"]),
             popup_prop="name",
             min=0,
             max=max_y,
             circle_options=dict(radius=10),
+            layer=layer,
         )
 
-        if selected_row_id and selected_row_id != []:
-
-            selected_row = dff_state[dff_state["id"].isin(selected_row_id)]
+        coordinates = get_coordinates(ST)
+        selected_row = coordinates[coordinates["id"].isin(selected_row_id or [])]
+        if not selected_row.empty:
 
             lat = selected_row.iloc[0]["lat"]
             lng = selected_row.iloc[0]["lng"]
 
-            hideout = dict(
-                colorscale=colors,
-                color_prop=color_column,
-                popup_prop="name",
-                min=0,
-                max=max_y,
-                open=selected_row_id[0],
-                circle_options=dict(radius=10),
-            )
+            hideout["open"] = selected_row_id[0]
             return (
                 styles,
                 bar_charts,
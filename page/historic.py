@@ -1,22 +1,26 @@
 from dash.dependencies import Input, Output, State
 import dash_table
 import dash_table.FormatTemplate as FormatTemplate
+from dash.exceptions import PreventUpdate
 import dash_core_components as dcc
 import dash_html_components as html
 import pandas as pd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import plotly.graph_objects as go
 
 import pathlib
 import dash_bootstrap_components as dbc
 
 from app import app, navbar3, footer3, asset_allocation_text, backtesting_text
+import data_utilities as du
 
 # Input Files
 PATH = pathlib.Path(__file__).parent
 DATA_PATH = PATH.joinpath("../assets").resolve()
 
 #  make dataframe from  spreadsheet:
-df = pd.read_excel(DATA_PATH.joinpath("historic.xlsx"))
+df = du.read_excel_cached(DATA_PATH.joinpath("historic.xlsx"))
 
 MAX_YR = df.Year.max()
 MIN_YR = df.Year.min()
@@ -58,70 +62,137 @@ OPTIONS, TIMEFRAME = highlights()
 ####### functions for Backtest results, cagr and worst periods #################
 
 
+# the portfolio assets and the annual return column used for each
+ASSETS = ["Cash", "Bonds", "Stocks"]
+ASSET_RETURNS = ["3-mon T.Bill", "10yr T.Bond", "S&P 500"]
+
+
+def allocation(stocks, cash):
+    """ returns the slider allocation as weights in ASSETS order"""
+    return np.array([cash, 100 - stocks - cash, stocks]) / 100
+
+
+def portfolio_growth(returns, weights):
+    """ returns the growth of $1 in each year when the portfolio is rebalanced"""
+    return ((1 + returns) * weights).sum(axis=-1)
+
+
+def portfolio_total(growth, start_bal, pmt=0, inflation=None, price_index=None):
+    """Calculates the total balance of a portfolio that grows by growth each year.
+    pmt is added at the beginning of each year (a withdrawal when it's negative) and
+    is adjusted for inflation.  The balance is then the cumulative product of the
+    growth times the start balance plus the cashflows discounted by that growth.
+    Once the balance runs out, it stays at 0.
+
+    args:
+        growth: growth of $1 each year (..., years)
+        start_bal: the starting balance
+        pmt: annual cashflow in start year dollars.  A number, or an array that
+             broadcasts with growth ie (paths, 1) for one pmt per path
+        inflation: the annual inflation rates (..., years).  Needed when pmt isn't 0
+        price_index: np.cumprod(1 + inflation) if it's already calculated
+
+    Returns: total balances (..., years + 1) where [..., 0] is the starting balance,
+             and the cashflow for each year (..., years)
+    """
+    cumulative = np.cumprod(growth, axis=-1)
+    if np.any(pmt):
+        index = price_index
+        if index is None:
+            index = np.cumprod(1 + inflation, axis=-1)
+        index = np.concatenate([np.ones_like(index[..., :1]), index[..., :-1]], axis=-1)
+        cashflows = pmt * index
+        prior = np.concatenate(
+            [np.ones_like(cumulative[..., :1]), cumulative[..., :-1]], axis=-1
+        )
+        total = cumulative * (start_bal + np.cumsum(cashflows / prior, axis=-1))
+        total = np.where(np.logical_or.accumulate(total <= 0, axis=-1), 0, total)
+    else:
+        cashflows = np.zeros_like(cumulative)
+        total = cumulative * start_bal
+
+    start = np.full(total.shape[:-1] + (1,), start_bal, dtype=total.dtype)
+    return np.concatenate([start, total], axis=-1), cashflows
+
+
+def backtest_kernel(returns, weights, start_bal, pmt=0, inflation=None):
+    """Calculates the balances of a portfolio that is rebalanced at the beginning of
+    each year.  Since the portfolio is rebalanced, the total grows by the weighted
+    return each year, so the path is a cumulative product (see portfolio_total).
+
+    Leading dimensions of returns are batches of paths (ie start years or simulations)
+    that are all calculated at once.
+
+    args:
+        returns: array of annual returns  (..., years, assets)
+        weights: allocation for each asset (assets,), or an allocation for each year
+                 (..., years, assets) ie a glide path.  Leading dimensions of a
+                 schedule are more paths, so several schedules run at once.
+        start_bal: the starting balance
+        pmt: annual contribution (or withdrawal when negative), see portfolio_total
+        inflation: the annual inflation rates (..., years)
+
+    Returns: balances by asset (..., years + 1, assets), total balances
+             (..., years + 1) and the cashflows that were made (..., years) ie a
+             withdrawal is no more than the balance.  [..., 0] is the starting
+             balance.
+    """
+    growth = 1 + returns
+    total, cashflows = portfolio_total(
+        portfolio_growth(returns, weights), start_bal, pmt, inflation
+    )
+
+    # the balance that's invested after this year's cashflow
+    invested = np.maximum(total[..., :-1] + cashflows, 0)
+    balances = invested[..., None] * weights * growth
+    first = weights if weights.ndim == 1 else weights[..., 0, :]
+    start_balances = np.broadcast_to(
+        first[..., None, :] * start_bal, balances.shape[:-2] + (1, len(ASSETS))
+    )
+    balances = np.concatenate([start_balances, balances], axis=-2)
+    return balances, total, invested - total[..., :-1]
+
+
+def valid_timeframe(planning_time, start_yr):
+    """ calculate valid time frames and ranges for UI"""
+    max_time = MAX_YR + 1 - start_yr
+    planning_time = max_time if planning_time > max_time else planning_time
+    if start_yr + planning_time > MAX_YR:
+        start_yr = min(df.iloc[-planning_time, 0], MAX_YR)  # 0 is Year column
+    return planning_time, int(start_yr)
+
+
 def backtest(stocks, cash, start_bal, nper, start_yr, pmt):
     """calculates the investment returns for user selected asset allocation,
-    rebalanced annually
+    rebalanced annually.  pmt is an annual contribution (or withdrawal when negative)
+    made at the beginning of each year and adjusted for inflation.
     """
 
     end_yr = start_yr + nper - 1
-    cash_allocation = cash / 100
-    stocks_allocation = stocks / 100
-    bonds_allocation = (100 - stocks - cash) / 100
 
     # Select time period - since data is for year end, include year prior for start ie year[0]
-    dff = df[(df.Year >= start_yr - 1) & (df.Year <= end_yr)].set_index(
-        "Year", drop=False
-    )
+    dff = df[(df.Year >= start_yr - 1) & (df.Year <= end_yr)].reset_index(drop=True)
     dff["Year"] = dff["Year"].astype(int)
-
-    # add columns for My Portfolio returns
-    dff["Cash"] = cash_allocation * start_bal
-    dff["Bonds"] = bonds_allocation * start_bal
-    dff["Stocks"] = stocks_allocation * start_bal
-    dff["Total"] = start_bal
-    dff["Rebalance"] = True
+    inflation = dff["Inflation"].to_numpy()[1:]
 
     # calculate My Portfolio returns
-    for yr in dff.Year + 1:
-        if yr <= end_yr:
-            # Rebalance at the beginning of the period by reallocating
-            # last period's total ending balance
-            if dff.loc[yr, "Rebalance"]:
-                dff.loc[yr, "Cash"] = dff.loc[yr - 1, "Total"] * cash_allocation
-                dff.loc[yr, "Stocks"] = dff.loc[yr - 1, "Total"] * stocks_allocation
-                dff.loc[yr, "Bonds"] = dff.loc[yr - 1, "Total"] * bonds_allocation
-
-            # calculate this period's  returns
-            dff.loc[yr, "Cash"] = dff.loc[yr, "Cash"] * (
-                1 + dff.loc[yr, "3-mon T.Bill"]
-            )
-            dff.loc[yr, "Stocks"] = dff.loc[yr, "Stocks"] * (1 + dff.loc[yr, "S&P 500"])
-            dff.loc[yr, "Bonds"] = dff.loc[yr, "Bonds"] * (
-                1 + dff.loc[yr, "10yr T.Bond"]
-            )
-            dff.loc[yr, "Total"] = dff.loc[yr, ["Cash", "Bonds", "Stocks"]].sum()
-
-    dff = dff.reset_index(drop=True)
-    columns = ["Cash", "Stocks", "Bonds", "Total"]
-    dff[columns] = dff[columns].round(0)
+    returns = dff[ASSET_RETURNS].to_numpy()[1:]
+    balances, total, cashflows = backtest_kernel(
+        returns, allocation(stocks, cash), start_bal, pmt, inflation
+    )
+    for i, col in enumerate(ASSETS):
+        dff[col] = balances[:, i].round(0)
+    dff["Total"] = total.round(0)
+    dff["Rebalance"] = True
 
     ### create columns for when portfolio is all cash, all bonds or  all stocks,
-    #   include inflation too
-    #
-    # create new df that starts in yr 1 rather than yr 0
-    dff1 = (dff[(dff.Year >= start_yr) & (dff.Year <= end_yr)]).copy()
-    #
-    # calculate the returns in new df:
+    #   include inflation too.  These have the same cashflows as My Portfolio
     columns = ["All_Cash", "All_Bonds", "All_Stocks", "Inflation_only"]
-    annual_returns = ["3-mon T.Bill", "10yr T.Bond", "S&P 500", "Inflation"]
-    for col, return_pct in zip(columns, annual_returns):
-        dff1[col] = round(start_bal * (1 + (1 + dff1[return_pct]).cumprod() - 1), 0)
-    #
-    # select columns in the new df to merge with original
-    dff1 = dff1[["Year"] + columns]
-    dff = dff.merge(dff1, how="left")
-    # fill in the starting balance for year[0]
-    dff.loc[0, columns] = start_bal
+    for col, return_pct in zip(columns, ASSET_RETURNS + ["Inflation"]):
+        growth = 1 + dff[return_pct].to_numpy()[1:]
+        all_total, _ = portfolio_total(growth, start_bal, pmt, inflation)
+        dff[col] = all_total.round(0)
+    dff["Cashflow"] = np.concatenate([[0], cashflows]).round(0)
     return dff
 
 
@@ -129,12 +200,24 @@ def cagr(dff):
     """calculate Compound Annual Growth Rate for a series: """
 
     start_bal = dff.iat[0]
+    if start_bal <= 0:
+        return "n/a"
     end_bal = dff.iat[-1]
     planning_time = len(dff) - 1
     cagr_result = ((end_bal / start_bal) ** (1 / planning_time)) - 1
     return f"{cagr_result:.1%}"
 
 
+def cagr_returns(dff, asset):
+    """calculate Compound Annual Growth Rate of the annual returns of an asset.
+    Unlike the balances, these don't depend on the cashflows or start balance.
+    """
+
+    returns = dff[asset].iloc[1:]  # the first row is the year prior to the start
+    cagr_result = np.prod(1 + returns) ** (1 / len(returns)) - 1
+    return f"{cagr_result:.1%}"
+
+
 def worst(dff, asset):
     """calculate worst returns for asset in selected period
     and format for display panel"""
@@ -144,6 +227,217 @@ def worst(dff, asset):
     return f"{worst_yr}:  {worst_yr_loss:.1%}"
 
 
+####### functions for all start years  #################
+
+PERCENTILES = [5, 10, 25, 50, 75, 90, 95]
+ROLLING_METRICS = ["Ending Balance", "CAGR", "Max Drawdown"]
+
+
+def rolling_windows(nper, columns):
+    """Makes a view of the columns for every nper year period in the data
+
+    Returns: the start years and the windows (start years, nper, columns)
+    """
+    values = df[columns].to_numpy()[1:]
+    windows = sliding_window_view(values, nper, axis=0).swapaxes(-1, -2)
+    start_yrs = df["Year"].to_numpy()[1 : len(windows) + 1].astype(int)
+    return start_yrs, windows
+
+
+def rolling_backtest(stocks, cash, start_bal, nper, pmt=0):
+    """Backtests the asset allocation for every possible start year at once.
+
+    Returns: df with a row for each start year and columns for the ending balance,
+             CAGR and max drawdown (the largest drop from a prior year end high)
+             of the portfolio returns, and whether the balance ran out
+    """
+    start_yrs, windows = rolling_windows(nper, ASSET_RETURNS + ["Inflation"])
+    growth = portfolio_growth(windows[..., :-1], allocation(stocks, cash))
+    total, _ = portfolio_total(growth, start_bal, pmt, windows[..., -1])
+
+    # the returns without cashflows
+    cumulative, _ = portfolio_total(growth, 1)
+    drawdown = cumulative / np.maximum.accumulate(cumulative, axis=-1) - 1
+    return pd.DataFrame(
+        {
+            "Start Year": start_yrs,
+            "End Year": start_yrs + nper - 1,
+            "Ending Balance": total[:, -1],
+            "CAGR": cumulative[:, -1] ** (1 / nper) - 1,
+            "Max Drawdown": drawdown.min(axis=-1),
+            "Ran Out": (total[:, -1] <= 0) & (pmt < 0),
+        }
+    )
+
+
+def safe_withdrawal_rate(stocks, cash, nper, iterations=30):
+    """Finds the largest withdrawal rate that lasts nper years for every start
+    year.  The rate is the first year's withdrawal as a fraction of the starting
+    balance, and it's adjusted for inflation after that.  The bisection runs on all
+    the start years at once.
+
+    Returns: the start years and the withdrawal rate for each
+    """
+    start_yrs, windows = rolling_windows(nper, ASSET_RETURNS + ["Inflation"])
+    growth = portfolio_growth(windows[..., :-1], allocation(stocks, cash))
+
+    low = np.zeros(len(start_yrs))
+    high = np.ones(len(start_yrs))
+    for _ in range(iterations):
+        rate = (low + high) / 2
+        total, _ = portfolio_total(growth, 1, -rate[:, None], windows[..., -1])
+        lasts = total[:, -1] > 0
+        low = np.where(lasts, rate, low)
+        high = np.where(lasts, high, rate)
+    return start_yrs, low
+
+
+####### functions for simulations  #################
+
+# the number of paths is capped at the largest option (ie a callback with a made up
+# value) so a simulation can't take all the memory of the server
+SIM_PATHS = [10_000, 100_000]
+# paths are run in chunks so the temporary arrays stay small
+SIM_CHUNK = 10_000
+SIM_SEED = 2020
+FAN_PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def simulate_chunk(growth, inflation, nper, start_bal, pmt, n_paths, rng):
+    """Bootstraps n_paths of nper years.  Each year is drawn (with replacement) from
+    the historic years, so the returns of all the assets and inflation come from the
+    same year.
+
+    args:
+        growth: the portfolio growth of $1 for each historic year (float32)
+        inflation: the inflation rate for each historic year (float32)
+        nper: number of years
+        start_bal: the starting balance
+        pmt: annual contribution (or withdrawal when negative), see portfolio_total
+        n_paths: number of paths
+        rng: np.random.Generator
+
+    Returns: the balance of each path for each year (n_paths, nper + 1), and the
+             number of paths that end below the start, below the start adjusted for
+             inflation, and that ran out of money
+    """
+    years = rng.integers(0, len(growth), size=(n_paths, nper))
+    price_index = np.cumprod(1 + inflation[years], axis=1)
+    total, _ = portfolio_total(
+        growth[years], start_bal, pmt, price_index=price_index
+    )
+    end_bal = total[:, -1]
+    real = end_bal / price_index[:, -1]
+    counts = [end_bal < start_bal, real < start_bal, (end_bal <= 0) & (pmt < 0)]
+    return (total, *(np.count_nonzero(count) for count in counts))
+
+
+def simulate(stocks, cash, start_bal, nper, n_paths, pmt=0):
+    """Simulates the asset allocation with bootstrapped returns.  Paths are run in
+    chunks of SIM_CHUNK in float32, and the fan percentiles are taken from all the
+    paths.  n_paths is capped at max(SIM_PATHS).
+
+    Returns: the FAN_PERCENTILES of the balance for each year (percentiles, nper + 1),
+             the probability of a loss, of a loss after inflation and of running
+             out of money, and the number of paths simulated
+    """
+    n_paths = min(n_paths, max(SIM_PATHS))
+    returns = df[ASSET_RETURNS].to_numpy()[1:]
+    growth = portfolio_growth(returns, allocation(stocks, cash)).astype(np.float32)
+    inflation = df["Inflation"].to_numpy(dtype=np.float32)[1:]
+
+    rng = np.random.default_rng(SIM_SEED)
+    totals = np.empty((n_paths, nper + 1), dtype=np.float32)
+    counts = np.zeros(3, dtype=np.int64)
+    for start in range(0, n_paths, SIM_CHUNK):
+        n = min(SIM_CHUNK, n_paths - start)
+        result = simulate_chunk(growth, inflation, nper, start_bal, pmt, n, rng)
+        totals[start : start + n] = result[0]
+        counts += result[1:]
+
+    fan = np.percentile(totals, FAN_PERCENTILES, axis=0)
+    loss, real_loss, ran_out = counts / n_paths
+    return fan, loss, real_loss, ran_out, n_paths
+
+
+####### functions for the allocation frontier  #################
+
+FRONTIER_STEPS = [5, 1]
+FRONTIER_RISKS = ["Volatility", "Worst Year"]
+
+
+def allocation_grid(step):
+    """ every allocation in step % increments as weights (portfolios, assets)"""
+    cash, stocks = np.meshgrid(
+        np.arange(0, 101, step), np.arange(0, 101, step), indexing="ij"
+    )
+    keep = cash + stocks <= 100
+    cash, stocks = cash[keep], stocks[keep]
+    return np.column_stack([cash, 100 - cash - stocks, stocks]) / 100
+
+
+def frontier(step, nper, start_yr):
+    """Calculates the returns of every allocation on the grid for the time period.
+    The annual returns of all the portfolios are one matrix product.
+
+    Returns: df with a row for each allocation and columns for the allocation %,
+             CAGR, volatility (standard deviation of the annual returns) and
+             the worst year
+    """
+    weights = allocation_grid(step)
+    end_yr = start_yr + nper - 1
+    returns = df.loc[(df.Year >= start_yr) & (df.Year <= end_yr), ASSET_RETURNS]
+
+    # (years, portfolios)
+    portfolio_returns = returns.to_numpy() @ weights.T
+    growth = np.prod(1 + portfolio_returns, axis=0)
+
+    dff = pd.DataFrame((weights * 100).round().astype(int), columns=ASSETS)
+    dff["CAGR"] = growth ** (1 / nper) - 1
+    dff["Volatility"] = portfolio_returns.std(axis=0, ddof=1 if nper > 1 else 0)
+    dff["Worst Year"] = portfolio_returns.min(axis=0)
+    return dff
+
+
+####### functions for glide paths  #################
+
+GLIDE_PATHS = ["Fixed", "Linear", "Target Date"]
+# years before the end that the target date glide path starts
+TARGET_DATE_YEARS = 10
+
+
+def glide_paths(stocks, cash, end_stocks, end_cash, nper):
+    """Makes allocation schedules that move from the start allocation to the end
+    allocation:  Fixed stays at the start allocation, Linear moves evenly every
+    year and Target Date holds the start allocation until the last
+    TARGET_DATE_YEARS years.
+
+    Returns: weights for GLIDE_PATHS (paths, nper, assets)
+    """
+    start = allocation(stocks, cash)
+    end = allocation(end_stocks, end_cash)
+    hold = max(nper - TARGET_DATE_YEARS, 0)
+
+    fixed = np.broadcast_to(start, (nper, len(ASSETS)))
+    linear = np.linspace(start, end, nper)
+    target_date = np.vstack([fixed[:hold], np.linspace(start, end, nper - hold)])
+    return np.stack([fixed, linear, target_date])
+
+
+def glide_backtest(weights, start_bal, nper, start_yr, pmt=0):
+    """Backtests allocation schedules for the time period with one kernel call
+
+    Returns: the years (year[0] is the start) and the total balances of each
+             schedule (paths, nper + 1)
+    """
+    end_yr = start_yr + nper - 1
+    dff = df[(df.Year >= start_yr - 1) & (df.Year <= end_yr)]
+    returns = dff[ASSET_RETURNS].to_numpy()[1:]
+    inflation = dff["Inflation"].to_numpy()[1:]
+    _, total, _ = backtest_kernel(returns, weights, start_bal, pmt, inflation)
+    return dff["Year"].astype(int), total
+
+
 #####################  Tables   #####################################
 
 
@@ -159,7 +453,7 @@ total_returns_table = html.Div(
                     "type": "numeric",
                     "format": FormatTemplate.money(0),
                 }
-                for col in ["Cash", "Bonds", "Stocks", "Total"]
+                for col in ["Cash", "Bonds", "Stocks", "Total", "Cashflow"]
             ],
             style_table={
                 "overflowY": "scroll",
@@ -224,7 +518,7 @@ def make_summary_table(dff):
             html.Td(
                 html.I(className="fa fa-money-bill-alt", style={"font-size": "150%"})
             ),
-            html.Td(cagr(dff["All_Cash"])),
+            html.Td(cagr_returns(dff, "3-mon T.Bill")),
             html.Td(worst(dff, "3-mon T.Bill")),
         ],
     )
@@ -232,7 +526,7 @@ def make_summary_table(dff):
         [
             html.Td("Bonds"),
             html.Td(html.I(className="fa fa-handshake", style={"font-size": "150%"})),
-            html.Td(cagr(dff["All_Bonds"])),
+            html.Td(cagr_returns(dff, "10yr T.Bond")),
             html.Td(worst(dff, "10yr T.Bond")),
         ],
     )
@@ -240,7 +534,7 @@ def make_summary_table(dff):
         [
             html.Td("Stocks"),
             html.Td(html.I(className="fa fa-industry ", style={"font-size": "150%"})),
-            html.Td(cagr(dff["All_Stocks"])),
+            html.Td(cagr_returns(dff, "S&P 500")),
             html.Td(worst(dff, "S&P 500")),
         ],
     )
@@ -248,7 +542,7 @@ def make_summary_table(dff):
         [
             html.Td("Inflation"),
             html.Td(html.I(className="fa fa-ambulance", style={"font-size": "150%"})),
-            html.Td(cagr(dff["Inflation_only"])),
+            html.Td(cagr_returns(dff, "Inflation")),
             html.Td(" "),
         ],
     )
@@ -263,6 +557,42 @@ def make_summary_table(dff):
     return summary_table
 
 
+def make_rolling_table(dfr):
+    """ Make table to show the percentiles of the results for all start years"""
+
+    nper = dfr["End Year"].iat[0] - dfr["Start Year"].iat[0] + 1
+    percentiles = np.percentile(dfr[ROLLING_METRICS], PERCENTILES, axis=0)
+
+    table_header = [
+        html.Thead(
+            html.Tr(
+                [html.Th(f"Percentile of {len(dfr)} {nper} year periods")]
+                + [html.Th(metric) for metric in ROLLING_METRICS]
+            )
+        )
+    ]
+    rows = [
+        html.Tr(
+            [
+                html.Td(f"{pct}th"),
+                html.Td("${:0,.0f}".format(balance)),
+                html.Td(f"{cagr_result:.1%}"),
+                html.Td(f"{drawdown:.1%}"),
+            ]
+        )
+        for pct, (balance, cagr_result, drawdown) in zip(PERCENTILES, percentiles)
+    ]
+    table_body = [html.Tbody(rows, className="text-center")]
+
+    return dbc.Table(
+        table_header + table_body,
+        bordered=True,
+        responsive=True,
+        size="sm",
+        style={"backgroundColor": "whitesmoke"},
+    )
+
+
 datasource_text = dcc.Markdown(
     """    
     [Data source:](http://pages.stern.nyu.edu/~adamodar/New_Home_Page/datafile/histretSP.html)
@@ -356,6 +686,176 @@ def make_returns_chart(dff):
     return fig
 
 
+#########  Histogram of results for all start years
+def make_rolling_chart(dfr, metric, start_yr):
+    """Histogram of the metric for every start year.  The median and the
+    result for start_yr (if it's in dfr) are marked.
+    """
+    nper = dfr["End Year"].iat[0] - dfr["Start Year"].iat[0] + 1
+    first, last = dfr["Start Year"].iat[0], dfr["Start Year"].iat[-1]
+    title = f"{metric} for all {nper} year periods starting {first} to {last}"
+    tickformat = "$,.0f" if metric == "Ending Balance" else ".0%"
+
+    fig = go.Figure(
+        go.Histogram(
+            x=dfr[metric],
+            customdata=dfr["Start Year"],
+            name=metric,
+            marker=dict(color="#3399f3"),
+        )
+    )
+    fig.add_vline(
+        x=dfr[metric].median(),
+        line=dict(color="black", dash="dot"),
+        annotation_text="median",
+    )
+    selected = dfr[dfr["Start Year"] == start_yr]
+    if not selected.empty:
+        fig.add_vline(
+            x=selected[metric].iat[0],
+            line=dict(color="#cd0200", width=3),
+            annotation_text=f"starting {start_yr}",
+            annotation_position="top left",
+        )
+    fig.update_layout(
+        title=title,
+        template="none",
+        showlegend=False,
+        height=400,
+        bargap=0.05,
+        margin=dict(l=40, r=10, t=60, b=40),
+        yaxis=dict(title="Number of start years", fixedrange=True),
+        xaxis=dict(title=metric, tickformat=tickformat, fixedrange=True),
+    )
+    return fig
+
+
+#########  Fan chart of simulated balances
+def make_fan_chart(fan, n_paths):
+    """ Fan chart of the FAN_PERCENTILES of the simulated balances by year"""
+    nper = fan.shape[1] - 1
+    x = list(range(nper + 1))
+    title = f"{n_paths:,} simulated {nper} year periods"
+    bands = [(0, 4, "5th to 95th percentile"), (1, 3, "25th to 75th percentile")]
+
+    fig = go.Figure()
+    for low, high, name in bands:
+        fig.add_trace(
+            go.Scatter(
+                x=x,
+                y=fan[low],
+                line=dict(width=0),
+                showlegend=False,
+                hoverinfo="skip",
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=x,
+                y=fan[high],
+                name=name,
+                fill="tonexty",
+                line=dict(width=0),
+                fillcolor="rgba(51, 153, 243, 0.25)",
+                hoverinfo="skip",
+            )
+        )
+    fig.add_trace(
+        go.Scatter(x=x, y=fan[2], name="Median", marker=dict(color="black"))
+    )
+    fig.update_layout(
+        title=title,
+        template="none",
+        showlegend=True,
+        legend=dict(x=0.01, y=0.99),
+        height=400,
+        margin=dict(l=40, r=10, t=60, b=40),
+        yaxis=dict(tickprefix="$", fixedrange=True),
+        xaxis=dict(title="Years", fixedrange=True),
+    )
+    return fig
+
+
+#########  Frontier scatter plot
+def make_frontier_chart(dff, risk, stocks, cash, title):
+    """ Scatter plot of CAGR vs risk for each allocation.  My Portfolio is marked"""
+    hover = (
+        "Cash %{customdata[0]}%  Bonds %{customdata[1]}%  Stocks %{customdata[2]}%"
+        "<br>CAGR %{y:.1%}<br>" + risk + " %{x:.1%}<extra></extra>"
+    )
+    mine = dff[(dff["Stocks"] == stocks) & (dff["Cash"] == cash)]
+
+    fig = go.Figure()
+    fig.add_trace(
+        go.Scattergl(
+            x=dff[risk],
+            y=dff["CAGR"],
+            customdata=dff[ASSETS],
+            mode="markers",
+            name="Allocations",
+            hovertemplate=hover,
+            marker=dict(
+                size=6,
+                color=dff["Stocks"],
+                colorscale="Blues",
+                colorbar=dict(title="Stocks %"),
+            ),
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=mine[risk],
+            y=mine["CAGR"],
+            customdata=mine[ASSETS],
+            mode="markers",
+            name="My Portfolio",
+            hovertemplate=hover,
+            marker=dict(size=16, color="#cd0200", symbol="star"),
+        )
+    )
+    fig.update_layout(
+        title=title,
+        template="none",
+        showlegend=True,
+        legend=dict(x=0.01, y=0.99),
+        height=400,
+        margin=dict(l=50, r=10, t=60, b=40),
+        yaxis=dict(title="CAGR", tickformat=".1%", fixedrange=True),
+        xaxis=dict(title=risk, tickformat=".0%", fixedrange=True),
+    )
+    return fig
+
+
+#########  Glide path chart
+def make_glide_chart(years, totals, weights):
+    """ Line chart of the balances of the GLIDE_PATHS"""
+    colors = ["black", "#3399f3", "#3cb521"]
+    title = f"Glide paths for {len(years) - 1} years starting {years.iat[1]}"
+
+    fig = go.Figure()
+    for name, total, weight, color in zip(GLIDE_PATHS, totals, weights, colors):
+        stocks = weight[:, ASSETS.index("Stocks")]
+        fig.add_trace(
+            go.Scatter(
+                x=years,
+                y=total,
+                name=f"{name}: stocks {stocks[0]:.0%} to {stocks[-1]:.0%}",
+                marker=dict(color=color),
+            )
+        )
+    fig.update_layout(
+        title=title,
+        template="none",
+        showlegend=True,
+        legend=dict(x=0.01, y=0.99),
+        height=400,
+        margin=dict(l=40, r=10, t=60, b=30),
+        yaxis=dict(tickprefix="$", fixedrange=True),
+        xaxis=dict(title="Year Ended", fixedrange=True),
+    )
+    return fig
+
+
 #####################  Make Tabs  ###################################
 
 
@@ -468,6 +968,26 @@ amount_input_card = html.Div(
                 ],
                 className="mb-3",
             ),
+            dbc.InputGroup(
+                [
+                    dbc.InputGroupAddon(
+                        "Add(+) or Withdraw(-) Each Year $ :", addon_type="prepend"
+                    ),
+                    dbc.Input(
+                        id="pmt3",
+                        placeholder="$",
+                        type="number",
+                        persistence=True,
+                        persistence_type="session",
+                        value=0,
+                    ),
+                ],
+                className="mb-1",
+            ),
+            html.Div(
+                "(at the start of each year, adjusted for inflation)",
+                className="mb-3",
+            ),
             dbc.InputGroup(
                 [
                     dbc.InputGroupAddon("Number of Years:", addon_type="prepend"),
@@ -557,6 +1077,141 @@ learn_card = html.Div(
     )
 )
 
+#########  Analyze Tab  Components
+rolling_card = html.Div(
+    dbc.Card(
+        [
+            dbc.CardHeader("My Portfolio for All Start Years"),
+            dbc.CardBody(
+                [
+                    html.Div(
+                        "The allocation, start amount and number of years from the "
+                        "Play tab are backtested for every start year in the data."
+                    ),
+                    dcc.RadioItems(
+                        id="rolling_metric3",
+                        options=[{"label": m, "value": m} for m in ROLLING_METRICS],
+                        value="CAGR",
+                        labelClassName="m-2",
+                        inputClassName="mr-2",
+                        persistence=True,
+                        persistence_type="session",
+                    ),
+                    dcc.Graph(id="rolling_chart3"),
+                    html.Div(id="rolling_table3"),
+                    html.Div(id="swr3"),
+                ]
+            ),
+        ],
+        outline=True,
+        className="mt-4",
+    )
+)
+
+simulation_card = html.Div(
+    dbc.Card(
+        [
+            dbc.CardHeader("Simulated Returns for My Portfolio"),
+            dbc.CardBody(
+                [
+                    html.Div(
+                        "Each path is made by picking years at random from the data, "
+                        "so stocks, bonds, cash and inflation are from the same year."
+                    ),
+                    dcc.RadioItems(
+                        id="sim_paths3",
+                        options=[
+                            {"label": f"{n:,} paths", "value": n} for n in SIM_PATHS
+                        ],
+                        value=SIM_PATHS[0],
+                        labelClassName="m-2",
+                        inputClassName="mr-2",
+                        persistence=True,
+                        persistence_type="session",
+                    ),
+                    dcc.Loading(dcc.Graph(id="sim_chart3")),
+                    html.Div(id="sim_results3", className="mt-2"),
+                ]
+            ),
+        ],
+        outline=True,
+        className="mt-4",
+    )
+)
+
+frontier_card = html.Div(
+    dbc.Card(
+        [
+            dbc.CardHeader("All Asset Allocations"),
+            dbc.CardBody(
+                [
+                    html.Div(
+                        "Every mix of cash, bonds and stocks is backtested for the "
+                        "time period on the Play tab."
+                    ),
+                    dcc.RadioItems(
+                        id="frontier_step3",
+                        options=[
+                            {"label": f"{step}% steps", "value": step}
+                            for step in FRONTIER_STEPS
+                        ],
+                        value=FRONTIER_STEPS[0],
+                        labelClassName="m-2",
+                        inputClassName="mr-2",
+                        persistence=True,
+                        persistence_type="session",
+                    ),
+                    dcc.RadioItems(
+                        id="frontier_risk3",
+                        options=[{"label": r, "value": r} for r in FRONTIER_RISKS],
+                        value=FRONTIER_RISKS[0],
+                        labelClassName="m-2",
+                        inputClassName="mr-2",
+                        persistence=True,
+                        persistence_type="session",
+                    ),
+                    dcc.Graph(id="frontier_chart3"),
+                ]
+            ),
+        ],
+        outline=True,
+        className="mt-4",
+    )
+)
+
+glide_card = html.Div(
+    dbc.Card(
+        [
+            dbc.CardHeader("Glide Paths"),
+            dbc.CardBody(
+                [
+                    html.Div(
+                        "Compare moving from the Play tab allocation to a different "
+                        "stock allocation by the end of the time period.  "
+                        f"Target Date moves in the last {TARGET_DATE_YEARS} years.  "
+                        "Cash stays the same and the rest is bonds."
+                    ),
+                    html.H6("Ending stock allocation %:", className="mt-3"),
+                    dcc.Slider(
+                        id="glide_stocks3",
+                        marks={i: "{}%".format(i) for i in range(0, 101, 10)},
+                        min=0,
+                        max=100,
+                        step=5,
+                        value=30,
+                        included=False,
+                        persistence=True,
+                        persistence_type="session",
+                    ),
+                    dcc.Graph(id="glide_chart3"),
+                ]
+            ),
+        ],
+        outline=True,
+        className="mt-4",
+    )
+)
+
 ######## Build tabs
 tabs = html.Div(
     dbc.Tabs(
@@ -585,6 +1240,12 @@ tabs = html.Div(
                 label="Results",
                 label_style={"font-size": "150%", "width": "125px"},
             ),
+            dbc.Tab(
+                [rolling_card, simulation_card, frontier_card, glide_card],
+                tab_id="tab-4",
+                label="Analyze",
+                label_style={"font-size": "150%", "width": "125px"},
+            ),
         ],
         id="tabs",
         active_tab="tab-2",
@@ -700,10 +1361,12 @@ def update_timeframe(selected_yr):
         Input("planning_time3", "value"),
         Input("start_yr3", "value"),
         Input("inflation", "value"),
+        Input("pmt3", "value"),
     ],
 )
-def update_totals(stocks, cash, start_bal, planning_time, start_yr, inflation):
-    pmt = 0
+def update_totals(stocks, cash, start_bal, planning_time, start_yr, inflation, pmt):
+    if pmt is None:
+        pmt = 0
     if start_bal is None:
         start_bal = 0
     if planning_time is None:
@@ -711,12 +1374,7 @@ def update_totals(stocks, cash, start_bal, planning_time, start_yr, inflation):
     if start_yr is None:
         start_yr = MIN_YR
 
-    # calculate valid time frames and ranges for UI
-    max_time = MAX_YR + 1 - start_yr
-    planning_time = max_time if planning_time > max_time else planning_time
-    if start_yr + planning_time > MAX_YR:
-        start_yr = min(df.iloc[-planning_time, 0], MAX_YR)  # 0 is Year column
-    start_yr = int(start_yr)
+    planning_time, start_yr = valid_timeframe(planning_time, start_yr)
 
     # create df of backtest results
     dff = backtest(stocks, cash, start_bal, planning_time, start_yr, pmt)
@@ -732,10 +1390,163 @@ def update_totals(stocks, cash, start_bal, planning_time, start_yr, inflation):
 
     summary_table = make_summary_table(dff)
 
-    results = "${:0,.0f}     {}".format(dff["Total"].iloc[-1], cagr(dff["Total"]))
+    results = "${:0,.0f}".format(dff["Total"].iloc[-1])
+    ran_out = dff.loc[dff["Total"] <= 0, "Year"]
+    if pmt < 0 and not ran_out.empty:
+        results += "     ran out in {}".format(ran_out.iat[0])
+    elif not pmt and start_bal > 0:
+        # with cashflows the CAGR of the balance isn't the portfolio return
+        results += "     {}".format(cagr(dff["Total"]))
 
     return data, figure, summary_table, results
 
 
+@app.callback(
+    [
+        Output("rolling_chart3", "figure"),
+        Output("rolling_table3", "children"),
+        Output("swr3", "children"),
+    ],
+    [
+        Input("tabs", "active_tab"),
+        Input("rolling_metric3", "value"),
+        Input("stock_bond3", "value"),
+        Input("cash3", "value"),
+        Input("starting_amount3", "value"),
+        Input("planning_time3", "value"),
+        Input("start_yr3", "value"),
+        Input("pmt3", "value"),
+    ],
+)
+def update_rolling(tab, metric, stocks, cash, start_bal, planning_time, start_yr, pmt):
+    if tab != "tab-4":
+        raise PreventUpdate
+    if pmt is None:
+        pmt = 0
+    if start_bal is None:
+        start_bal = 0
+    if planning_time is None:
+        planning_time = 1
+    planning_time = min(planning_time, MAX_YR - MIN_YR + 1)
+
+    dfr = rolling_backtest(stocks, cash, start_bal, planning_time, pmt)
+    figure = make_rolling_chart(dfr, metric, start_yr)
+
+    start_yrs, rates = safe_withdrawal_rate(stocks, cash, planning_time)
+    swr = [
+        html.Div(
+            f"Safe withdrawal rate:  {rates.min():.2%} of the start amount lasted "
+            f"{planning_time} years for every start year "
+            f"(worst start year {start_yrs[rates.argmin()]}, "
+            f"median {np.median(rates):.2%})"
+        )
+    ]
+    if pmt < 0:
+        swr.append(
+            html.Div(
+                f"Ran out of money in {dfr['Ran Out'].sum()} of {len(dfr)} periods"
+            )
+        )
+    return figure, make_rolling_table(dfr), swr
+
+
+@app.callback(
+    [Output("sim_chart3", "figure"), Output("sim_results3", "children")],
+    [
+        Input("tabs", "active_tab"),
+        Input("sim_paths3", "value"),
+        Input("stock_bond3", "value"),
+        Input("cash3", "value"),
+        Input("starting_amount3", "value"),
+        Input("planning_time3", "value"),
+        Input("pmt3", "value"),
+    ],
+)
+def update_simulation(tab, n_paths, stocks, cash, start_bal, planning_time, pmt):
+    if tab != "tab-4":
+        raise PreventUpdate
+    if pmt is None:
+        pmt = 0
+    if start_bal is None:
+        start_bal = 0
+    if planning_time is None:
+        planning_time = 1
+
+    fan, loss, real_loss, ran_out, n_paths = simulate(
+        stocks, cash, start_bal, planning_time, n_paths, pmt
+    )
+    figure = make_fan_chart(fan, n_paths)
+    results = [
+        html.Div(f"Chance of ending with less than the start amount:  {loss:.1%}"),
+        html.Div(
+            f"Chance of ending with less than the start amount after inflation:  "
+            f"{real_loss:.1%}"
+        ),
+    ]
+    if pmt < 0:
+        results.append(html.Div(f"Chance of running out of money:  {ran_out:.1%}"))
+    return figure, results
+
+
+@app.callback(
+    Output("frontier_chart3", "figure"),
+    [
+        Input("tabs", "active_tab"),
+        Input("frontier_step3", "value"),
+        Input("frontier_risk3", "value"),
+        Input("stock_bond3", "value"),
+        Input("cash3", "value"),
+        Input("planning_time3", "value"),
+        Input("start_yr3", "value"),
+    ],
+)
+def update_frontier(tab, step, risk, stocks, cash, planning_time, start_yr):
+    if tab != "tab-4":
+        raise PreventUpdate
+    if planning_time is None:
+        planning_time = 1
+    if start_yr is None:
+        start_yr = MIN_YR
+    planning_time, start_yr = valid_timeframe(planning_time, start_yr)
+
+    dff = frontier(step, planning_time, start_yr)
+    title = f"CAGR vs {risk} from {start_yr} to {start_yr + planning_time - 1}"
+    return make_frontier_chart(dff, risk, stocks, cash, title)
+
+
+@app.callback(
+    Output("glide_chart3", "figure"),
+    [
+        Input("tabs", "active_tab"),
+        Input("glide_stocks3", "value"),
+        Input("stock_bond3", "value"),
+        Input("cash3", "value"),
+        Input("starting_amount3", "value"),
+        Input("planning_time3", "value"),
+        Input("start_yr3", "value"),
+        Input("pmt3", "value"),
+    ],
+)
+def update_glide(
+    tab, end_stocks, stocks, cash, start_bal, planning_time, start_yr, pmt
+):
+    if tab != "tab-4":
+        raise PreventUpdate
+    if pmt is None:
+        pmt = 0
+    if start_bal is None:
+        start_bal = 0
+    if planning_time is None:
+        planning_time = 1
+    if start_yr is None:
+        start_yr = MIN_YR
+    planning_time, start_yr = valid_timeframe(planning_time, start_yr)
+    end_stocks = min(end_stocks, 100 - cash)
+
+    weights = glide_paths(stocks, cash, end_stocks, cash, planning_time)
+    years, totals = glide_backtest(weights, start_bal, planning_time, start_yr, pmt)
+    return make_glide_chart(years, totals, weights)
+
+
 if __name__ == "__main__":
     app.run_server(debug=True)
@@ -14,12 +14,14 @@ import plotly.graph_objects as go
 import plotly_express as px
 
 import pandas as pd
+import numpy as np
 import pathlib
-import pickle
+import itertools
 
 
 from app import app, navbar, footer
 import data_utilities as du
+from data_store import store
 import control_panel as cp
 import local
 
@@ -30,11 +32,12 @@ pd.set_option("display.max_columns", 10)
 PATH = pathlib.Path(__file__).parent
 DATA_PATH = PATH.joinpath("../data").resolve()
 
-with open(DATA_PATH.joinpath("df_exp.pickle"), "rb") as handle:
-    df_exp = pickle.load(handle)
+df_exp = store.get("df_exp")
+df_rev = store.get("df_rev")
 
-with open(DATA_PATH.joinpath("df_rev.pickle"), "rb") as handle:
-    df_rev = pickle.load(handle)
+# Cache for the choropleth and sunburst figures made in callbacks.  df_exp and df_rev
+# are loaded once, so the figures are good for the life of the process.
+figure_cache = du.FigureCache(maxsize=512)
 
 
 ############  This init section is is both state.py and local.py
@@ -51,26 +54,87 @@ def table_yr(dff, year):
     )
 
 
-#####################  Read Population by State  ##############################
+#####################  Population by State  ###################################
 
 
-def read_census_pop():
-    """Returns a df of stat population based on census data:
-    https://www.census.gov/data/tables/time-series/demo/popest/2010s-state-total.html
-    """
+df_pop = store.get("df_pop")
 
-    df = pd.read_excel(
-        DATA_PATH.joinpath("nst-est2019-01.xlsx"), skiprows=1, header=2, nrows=56
-    )
-    # remove the regions (states only) and rename state col
-    df_state_pop = df.tail(51).reindex()  # states+DC
-    df_state_pop = df_state_pop.rename(columns={"Unnamed: 0": "State"})
-    ## for some strange reason, the States had a "." at the start
-    df_state_pop["State"] = df_state_pop["State"].str.replace(".", "")
-    return df_state_pop
 
+#####################  Precomputed State table  ###############################
+
+# The State table is subtotaled by these columns depending on the selections
+TABLE_GROUPS = {
+    "state_local": ["State", "Category", "Description", "State/Local"],
+    "subcat": ["State", "Category", "Description"],
+    "cat": ["State", "Category"],
+    "state": ["State"],
+}
 
-df_pop = read_census_pop()
+# columns that can be filtered by the State, Category and Sub Category dropdowns
+TABLE_FILTERS = ["State", "Category", "Description"]
+
+
+def make_rollup(dff, group_columns):
+    """Precomputes one subtotal level of the State table.
+
+    args:
+        dff (df)              - df_exp or df_rev
+        group_columns [str]   - one of the TABLE_GROUPS
+
+    Returns:
+        dict with:
+        "df"      - dff subtotaled by the group_columns with the sparkline column
+        "rows"    - row positions in "df" for each (State, Category, Description)
+                    filter.  None means no filter, ie ("Alabama", None, None) is all
+                    Alabama rows
+        "records" - table data by year, filled in as years are selected
+    """
+    dff = dff.groupby(group_columns).sum().reset_index()
+    dff["sparkline"] = du.make_sparkline(dff, "Per Capita", du.YEARS)
+
+    filters = [col for col in TABLE_FILTERS if col in group_columns]
+    rows = {(None, None, None): np.arange(len(dff))}
+    for n in range(1, len(filters) + 1):
+        for columns in itertools.combinations(filters, n):
+            groups = dff.groupby(list(columns), sort=False).indices
+            for values, positions in groups.items():
+                values = dict(zip(columns, np.atleast_1d(values)))
+                rows[tuple(values.get(col) for col in TABLE_FILTERS)] = positions
+    return {"df": dff, "rows": rows, "records": {}}
+
+
+TABLE_ROLLUPS = {
+    exp_or_rev: {
+        level: make_rollup(dff, group_columns)
+        for level, group_columns in TABLE_GROUPS.items()
+    }
+    for exp_or_rev, dff in [("Expenditures", df_exp), ("Revenue", df_rev)]
+}
+
+
+def table_records(exp_or_rev, year, state, cat, subcat, local):
+    """ Returns the State table data for the selections from the TABLE_ROLLUPS"""
+    exp_or_rev = "Revenue" if exp_or_rev == "Revenue" else "Expenditures"
+    if local:
+        level = "state_local"
+    elif subcat:
+        level = "subcat"
+    elif cat:
+        level = "cat"
+    else:
+        level = "state"
+    rollup = TABLE_ROLLUPS[exp_or_rev][level]
+
+    key = (
+        None if state == "USA" else (state or "Alabama"),
+        cat if cat and (cat != "all") else None,
+        subcat if subcat and (subcat != "all") else None,
+    )
+    year = str(year)
+    if year not in rollup["records"]:
+        rollup["records"][year] = table_yr(rollup["df"], year).to_dict("records")
+    records = rollup["records"][year]
+    return [records[i] for i in rollup["rows"].get(key, [])]
 
 
 ######################    Figures   ###########################################
@@ -600,10 +664,7 @@ def update_exp_or_rev1(exp, rev, clear):
 
 #####  update state dropdown
 @app.callback(
-    [
-        Output("state", "value"),
-        Output("local_table", "page_current"),
-    ],
+    Output("state", "value"),
     [
         Input("map", "clickData"),
         Input("clear", "n_clicks"),
@@ -637,7 +698,7 @@ def update_state_dropdown(
         else:
             click_state = clickData["points"][0]["location"]
             state = du.abbr_state[click_state]
-    return state, 0
+    return state
 
 
 ##### updates sub category dropdown
@@ -703,10 +764,11 @@ def update_selected_state(selected_state, year, exp_or_rev):
         title = year + " Selected State"
         selected = 1
 
-    return (
-        make_sunburst(dff, path, du.get_col("Amount", year), title),
-        make_stats_table(population, dff, selected, year),
+    figure = figure_cache.get(
+        ("sunburst", exp_or_rev, selected_state, year, title),
+        lambda: make_sunburst(dff, path, du.get_col("Amount", year), title),
     )
+    return figure, make_stats_table(population, dff, selected, year)
 
 
 #### updates my state overview sunburst and stats.
@@ -729,10 +791,13 @@ def update_mystate(mystate, year, exp_or_rev):
     population = int(df_pop.loc[df_pop["State"] == mystate, int(year)])
     title = year + " My State"
 
-    return (
-        make_sunburst(dff, ["State", "Category"], du.get_col("Amount", year), title),
-        make_stats_table(population, dff, selected, year),
+    figure = figure_cache.get(
+        ("sunburst", exp_or_rev, mystate, year, title),
+        lambda: make_sunburst(
+            dff, ["State", "Category"], du.get_col("Amount", year), title
+        ),
     )
+    return figure, make_stats_table(population, dff, selected, year)
 
 
 ######  Switch Tabs, hide/show local controls  updateyear#######################
@@ -762,7 +827,6 @@ def switch_pages(_, __):
         Output("map", "figure"),
         Output("table", "data"),
         Output("sunburst_cat", "figure"),
-        Output("state_bar_charts_container", "children"),
         Output("all_states", "className"),
     ],
     [
@@ -772,7 +836,6 @@ def switch_pages(_, __):
         Input("category_dropdown", "value"),
         Input("subcategory_dropdown", "value"),
         Input("state_local_dropdown", "value"),
-        Input("table", "derived_viewport_data"),
     ],
     [State("store_exp_or_rev", "data")],
     #  prevent_initial_call=True,
@@ -784,11 +847,9 @@ def update_map(
     cat,
     subcat,
     local,
-    viewport,
     exp_or_rev,
 ):
-    dff_map = df_rev if exp_or_rev == "Revenue" else df_exp
-    dff_table = dff_sunburst = dff_map.copy()
+    dff_map = dff_sunburst = df_rev if exp_or_rev == "Revenue" else df_exp
     title = " ".join([str(year), exp_or_rev, "Per Capita by State"])
     map_title = title
     sunburst_title = " ".join(["All States ", str(year), exp_or_rev, "Per Capita "])
@@ -796,66 +857,56 @@ def update_map(
     all_state_btn = "d-none"
     # filter
     if state != "USA":
-        dff_table = (
-            dff_table[dff_table["State"] == state]
-            if state
-            else dff_table[dff_table["State"] == "Alabama"]
-        )
-        dff_sunburst = dff_table.copy()
+        dff_sunburst = dff_sunburst[dff_sunburst["State"] == (state or "Alabama")]
         sunburst_title = " ".join([str(year), exp_or_rev, state])
         all_state_btn = ""
 
     if cat and (cat != "all"):
-        dff_table = dff_table[dff_table["Category"] == cat]
         dff_map = dff_map[dff_map["Category"] == cat]
         map_title = " ".join([title, ": ", cat])
 
     if subcat and (subcat != "all"):
-        dff_table = dff_table[dff_table["Description"] == subcat]
         dff_map = dff_map[dff_map["Description"] == subcat]
         map_title = " ".join([title, ": ", subcat])
 
-    # subtotal
-    if local:
-        dff_table = (
-            dff_table.groupby(["State", "Category", "Description", "State/Local"])
-            .sum()
-            .reset_index()
-        )
-
-    elif subcat:
-        dff_table = (
-            dff_table.groupby(["State", "Category", "Description"]).sum().reset_index()
-        )
-
-    elif cat:
-        dff_table = dff_table.groupby(["State", "Category"]).sum().reset_index()
-
-    else:
-        dff_table = dff_table.groupby(["State"]).sum().reset_index()
-
-    dff_table["sparkline"] = du.make_sparkline(dff_table, "Per Capita", du.YEARS)
-    dff_table = table_yr(dff_table, str(year))
+    # filtered and subtotaled table from the precomputed rollups
+    table_data = table_records(exp_or_rev, year, state, cat, subcat, local)
 
     # update sunburst
-    figure = make_sunburst(
-        dff_sunburst,
-        ["Category", "Description", "State/Local"],
-        du.get_col("Amount", str(year)),
-        sunburst_title,
+    figure = figure_cache.get(
+        ("sunburst_cat", exp_or_rev, state, str(year), sunburst_title),
+        lambda: make_sunburst(
+            dff_sunburst,
+            ["Category", "Description", "State/Local"],
+            du.get_col("Amount", str(year)),
+            sunburst_title,
+        ),
     )
 
-    bar_charts = []
-    if len(dff_table["State"].unique()) > 1:
-        bar_charts = du.make_bar_charts(pd.DataFrame(viewport), "Per Capita", "State")
-
     if dff_map.empty:
-        return [], [], [], [], all_state_btn
+        return [], [], [], all_state_btn
+
+    map_figure = figure_cache.get(
+        ("choropleth", exp_or_rev, state, cat, subcat, str(year), map_title),
+        lambda: make_choropleth(dff_map, map_title, state, str(year)),
+    )
 
     return (
-        make_choropleth(dff_map, map_title, state, str(year)),
-        dff_table.to_dict("records"),
+        map_figure,
+        table_data,
         figure,
-        bar_charts,
         all_state_btn,
     )
+
+
+#######  update State bar charts  #############################################
+# Only uses the rows shown in the table, so paging or sorting the table doesn't
+# update the map, table or sunburst.
+@app.callback(
+    Output("state_bar_charts_container", "children"),
+    [Input("table", "derived_viewport_data")],
+)
+def update_state_bar_charts(viewport):
+    if not viewport or len({row["State"] for row in viewport}) < 2:
+        return []
+    return du.make_bar_charts(pd.DataFrame(viewport), "Per Capita", "State")
@@ -19,7 +19,6 @@ import dash_bootstrap_components as dbc
 import pandas as pd
 import numpy as np
 import pathlib
-import pickle
 import colorlover
 import json
 import dash_leaflet as dl
@@ -29,6 +28,7 @@ from app import app, navbar, footer
 
 
 import data_utilities as du
+from data_store import store
 
 
 pd.set_option("display.max_rows", 100)
@@ -39,50 +39,20 @@ PATH = pathlib.Path(__file__).parent
 DATA_PATH = PATH.joinpath("../data").resolve()
 
 
-with open(DATA_PATH.joinpath("df_exp.pickle"), "rb") as handle:
-    df_exp = pickle.load(handle)
-
-with open(DATA_PATH.joinpath("df_rev.pickle"), "rb") as handle:
-    df_rev = pickle.load(handle)
-
-with open(DATA_PATH.joinpath("df_lat_lng.pickle"), "rb") as handle:
-    df_lat_lng = pickle.load(handle)
+df_exp = store.get("df_exp")
+df_rev = store.get("df_rev")
+df_lat_lng = store.get("df_lat_lng")
 
 
 # Local  Expenditures and Revenue df
 def get_df_exp_rev(ST):
-    """ loads the df_exp and df_rev files by state and adds Cat and Descr columns"""
-    filename = "".join(["exp_rev_", ST, ".pickle"])
-    with open(DATA_PATH.joinpath(filename), "rb") as handle:
-        city_df_exp, city_df_rev = pickle.load(handle)
-
-    city_df_exp = pd.merge(city_df_exp, du.df_cat_desc, how="left", on="Line")
-    city_df_rev = pd.merge(city_df_rev, du.df_cat_desc, how="left", on="Line")
-
-    ### TODO move add lat long to data prep?
-    # city_df_exp = pd.merge(city_df_exp, df_lat_lng, how='left', left_on=['County name', 'ID name'],  right_on =['county_name', 'city'])
-    # city_df_exp['lat'] = city_df_exp['lat'].fillna(0)
-    #
-    # city_df_rev = pd.merge(city_df_rev, df_lat_lng, how='left', left_on=['County name', 'ID name'],
-    #                        right_on=['county_name', 'city'])
-    # city_df_rev['lat'] = city_df_rev['lat'].fillna(0)
-
-    ### TODO move rename to data prep
-    # this makes "ID code" the "id" for the dash datatable functions
-    city_df_exp = city_df_exp.rename(columns={"ID code": "id"})
-    city_df_rev = city_df_rev.rename(columns={"ID code": "id"})
-    return city_df_exp, city_df_rev
+    """ the local df_exp and df_rev by state from the data store"""
+    return store.get_local(ST)
 
 
 # initialize Local
 init_STATE = "AL"
-rev = {}
-exp = {}
-for STATE in du.abbr_state_noUS:
-    exp[STATE], rev[STATE] = get_df_exp_rev(STATE)
-
-init_city_df_exp = exp[init_STATE]
-init_city_df_rev = rev[init_STATE]
+init_city_df_exp, init_city_df_rev = get_df_exp_rev(init_STATE)
 
 
 # initialize State
@@ -129,26 +99,10 @@ def year_filter(dff, year):
     )
 
 
-#####################  Read Population by State  ##############################
-
+#####################  Population by State  ###################################
 
-def read_census_pop():
-    """Returns a df of stat population based on census data:
-    https://www.census.gov/data/tables/time-series/demo/popest/2010s-state-total.html
-    """
-
-    df = pd.read_excel(
-        DATA_PATH.joinpath("nst-est2019-01.xlsx"), skiprows=1, header=2, nrows=56
-    )
-    # remove the regions (states only) and rename state col
-    df_state_pop = df.tail(51).reindex()  # states+DC
-    df_state_pop = df_state_pop.rename(columns={"Unnamed: 0": "State"})
-    ## for some strange reason, the States had a "." at the start
-    df_state_pop["State"] = df_state_pop["State"].str.replace(".", "")
-    return df_state_pop
 
-
-df_pop = read_census_pop()
+df_pop = store.get("df_pop")
 
 
 ######################    Figures   ###########################################
@@ -1338,7 +1292,7 @@ def update_counties(state):
         state = "Alabama"
     options = [{"label": "All Counties", "value": "all"}] + [
         {"label": c, "value": c}
-        for c in exp[du.state_abbr[state]]["County name"]
+        for c in get_df_exp_rev(du.state_abbr[state])[0]["County name"]
         .sort_values()
         .dropna()
         .unique()
@@ -1365,16 +1319,11 @@ def update_counties(
     if state == "USA":
         state = "Alabama"
 
-    dff = exp[du.state_abbr[state]].copy()
+    dff = get_df_exp_rev(du.state_abbr[state])[0]
 
-    if type and (type != "all"):
-        if type == "c":
-            dff = dff[
-                dff["Gov Type"].str.contains("2", na=False)
-                | dff["Gov Type"].str.contains("3", na=False)
-            ]
-        else:
-            dff = dff[dff["Gov Type"].str.contains(type, na=False)]
+    gov_types = du.gov_type_codes(type)
+    if gov_types is not None:
+        dff = dff[dff["Gov Type"].isin(gov_types)]
     if county and (county != "all"):
         dff = dff[dff["County name"] == county]
 
@@ -1609,21 +1558,13 @@ def update_city_table(exp_or_rev, year, cat, subcat, state, type, county, name):
     title = " ".join([str(year), state, exp_or_rev])
     update_title = title
 
-    df_table = (
-        rev[du.state_abbr[state]]
-        if exp_or_rev == "Revenue"
-        else exp[du.state_abbr[state]]
-    )
+    city_df_exp, city_df_rev = get_df_exp_rev(du.state_abbr[state])
+    df_table = city_df_rev if exp_or_rev == "Revenue" else city_df_exp
 
     # filter  table
-    if type and (type != "all"):
-        if type == "c":
-            df_table = df_table[
-                df_table["Gov Type"].str.contains("2", na=False)
-                | df_table["Gov Type"].str.contains("3", na=False)
-            ].copy()
-        else:
-            df_table = df_table[df_table["Gov Type"].str.contains(type, na=False)]
+    gov_types = du.gov_type_codes(type)
+    if gov_types is not None:
+        df_table = df_table[df_table["Gov Type"].isin(gov_types)]
         update_title = " ".join([title, " --> ", du.code_type[type]])
     if cat and (cat != "all"):
         df_table = df_table[df_table["Category"] == cat]
@@ -1641,14 +1582,18 @@ def update_city_table(exp_or_rev, year, cat, subcat, state, type, county, name):
     main_columns = ["ST", "id", "County name", "ID name", "Gov Type"]
     if subcat:
         df_table = (
-            df_table.groupby(main_columns + ["Category", "Description"])
+            df_table.groupby(main_columns + ["Category", "Description"], observed=True)
             .sum()
             .reset_index()
         )
     elif cat:
-        df_table = df_table.groupby(main_columns + ["Category"]).sum().reset_index()
+        df_table = (
+            df_table.groupby(main_columns + ["Category"], observed=True)
+            .sum()
+            .reset_index()
+        )
     else:
-        df_table = df_table.groupby(main_columns).sum().reset_index()
+        df_table = df_table.groupby(main_columns, observed=True).sum().reset_index()
 
     # remove empty cols
     df_table = df_table.loc[:, (df_table != 0).any(axis=0)]
@@ -1657,7 +1602,7 @@ def update_city_table(exp_or_rev, year, cat, subcat, state, type, county, name):
         return [], [], [], True
 
     # school district columns
-    if (df_table["Gov Type"] == "5").all():
+    if (df_table["Gov Type"] == 5).all():
         columns = city_columns + perstudent_columns
         df_table["sparkline_Per Student"] = make_sparkline(
             df_table, "Per Student", CITY_YEARS
@@ -1667,7 +1612,7 @@ def update_city_table(exp_or_rev, year, cat, subcat, state, type, county, name):
         update_title = " ".join([update_title, du.code_type["5"]])
 
     # special districts columns
-    elif (df_table["Gov Type"] == "4").all():
+    elif (df_table["Gov Type"] == 4).all():
         columns = city_columns
         df_table = year_filter(df_table, str(year))
         update_title = " ".join([update_title, du.code_type["4"]])
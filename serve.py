@@ -0,0 +1,188 @@
+"""
+Production server for the app.  The data is loaded once, then worker processes are
+forked that share it copy-on-write:
+
+    python serve.py --workers 4 --port 8050
+
+The parent process imports the app (the State page data) and loads the local data for
+every state into the data store (see data_store.py).  It prints the memory of each
+dataset, then freezes those objects so the garbage collector doesn't write to their
+memory pages (which would un-share them).  The workers all serve the same socket.  The
+parent restarts workers that exit and reports the memory of each worker.
+
+If data/arena has been made (see du.write_arena), the numeric columns are memory
+mapped from that file, so they stay shared even when pandas touches the other columns.
+
+index.py is still used for development (python index.py).
+
+Note:  os.fork is needed, so this runs on Linux and macOS.  The memory report reads
+/proc, so it's only on Linux.
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import data_utilities as du
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the app with worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="number of processes"
+    )
+    parser.add_argument(
+        "--states",
+        nargs="*",
+        default=list(du.abbr_state_noUS),
+        help="states to load before forking ie AL AZ.  Default is all states",
+    )
+    parser.add_argument(
+        "--report",
+        type=int,
+        default=300,
+        help="seconds between worker memory reports (0 for no reports)",
+    )
+    return parser.parse_args()
+
+
+def preload(states):
+    """Imports the app and loads the local data for the states.  Returns the app."""
+    # keep every state loaded (see data_store.LOCAL_CACHE_SIZE)
+    os.environ.setdefault("LOCAL_CACHE_SIZE", str(max(len(states), 1)))
+
+    import index
+    import local
+    from data_store import store
+
+    # no threads can be running when the workers are forked
+    if local.prewarm_thread is not None:
+        local.prewarm_thread.join()
+
+    for ST in states:
+        try:
+            local.get_df_exp_rev(ST)
+        except FileNotFoundError:
+            print("no local data for", ST)
+            continue
+        for exp_or_rev in ["Expenditures", "Revenue"]:
+            local.get_filter_index(ST, exp_or_rev)
+        local.get_coordinates(ST)
+
+    report = store.memory_report()
+    print(report.to_string(index=False))
+    print("total data {:.1f} MB".format(report["MB"].sum()), flush=True)
+    return index.app
+
+
+def memory(pid):
+    """Returns the memory of a process in MB:  rss, pss (rss with shared pages divided
+    between the processes sharing them) and shared.  None if /proc isn't available.
+    """
+    try:
+        with open("/proc/{}/smaps_rollup".format(pid)) as handle:
+            lines = handle.read().splitlines()
+    except OSError:
+        return None
+
+    kb = {}
+    for line in lines[1:]:
+        parts = line.split()
+        if len(parts) >= 2 and parts[1].isdigit():
+            kb[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": kb.get("Rss", 0) / 1024,
+        "pss": kb.get("Pss", 0) / 1024,
+        "shared": (kb.get("Shared_Clean", 0) + kb.get("Shared_Dirty", 0)) / 1024,
+    }
+
+
+def report(workers):
+    """prints the memory of the parent and each worker"""
+    total = 0
+    for name, pid in [("parent", os.getpid())] + [
+        ("worker", pid) for pid in sorted(workers)
+    ]:
+        mb = memory(pid)
+        if mb is None:
+            return
+        total += mb["pss"]
+        print(
+            "{:6} {:>7}  rss {:8.1f} MB  pss {:8.1f} MB  shared {:8.1f} MB".format(
+                name, pid, mb["rss"], mb["pss"], mb["shared"]
+            )
+        )
+    print("total pss {:.1f} MB".format(total), flush=True)
+
+
+def run_worker(app, sock, host):
+    """serves requests on the shared socket until the process is stopped"""
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = make_server(host, 0, app.server, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def start_worker(app, sock, host):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(app, sock, host)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def main():
+    args = parse_args()
+    app = preload(args.states)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    # objects made so far are never collected, so the workers don't touch their pages
+    gc.collect()
+    gc.freeze()
+
+    workers = {start_worker(app, sock, args.host) for _ in range(max(args.workers, 1))}
+    print(
+        "serving on http://{}:{} with {} workers".format(
+            args.host, args.port, len(workers)
+        ),
+        flush=True,
+    )
+
+    def stop(signum, frame):
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    next_report = time.monotonic() + 10
+    while True:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid in workers:
+            print("worker {} exited ({}), restarting".format(pid, status), flush=True)
+            workers.remove(pid)
+            workers.add(start_worker(app, sock, args.host))
+        if args.report and time.monotonic() >= next_report:
+            report(workers)
+            next_report = time.monotonic() + args.report
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()
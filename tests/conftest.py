@@ -0,0 +1,6 @@
+"""pytest setup:  the app modules are imported from the repo root (ie page.historic)"""
+
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
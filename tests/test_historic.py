@@ -0,0 +1,93 @@
+"""
+Compares the vectorized backtest in page/historic.py with a year by year loop, like
+the one it replaced.  The backtest multiplies the growth in a different order than
+the loop, so the balances match to a tiny fraction of a dollar, and the rounded
+balances in the table match within $1 (ie 10968.5 in the loop can be 10968.500000000002
+in the backtest and round up).
+
+    python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+import page.historic as historic
+
+
+def loop_backtest(stocks, cash, start_bal, nper, start_yr, pmt=0):
+    """Reference backtest:  rebalances at the beginning of each year, one year at a
+    time.  pmt is added at the beginning of each year and adjusted for inflation.
+    Once the balance runs out it stays at 0.
+
+    Returns: the total balance for each year (nper + 1), starting with start_bal
+    """
+    weights = historic.allocation(stocks, cash)
+    df = historic.df
+    dff = df[(df.Year >= start_yr) & (df.Year <= start_yr + nper - 1)]
+
+    balance = float(start_bal)
+    price_index = 1.0
+    totals = [balance]
+    ran_out = False
+    for _, row in dff.iterrows():
+        invested = balance + pmt * price_index
+        ran_out = ran_out or invested <= 0
+        if ran_out:
+            balance = 0.0
+        else:
+            balance = sum(
+                invested * weight * (1 + row[col])
+                for weight, col in zip(weights, historic.ASSET_RETURNS)
+            )
+        totals.append(balance)
+        price_index *= 1 + row["Inflation"]
+    return np.array(totals)
+
+
+CASES = [
+    (stocks, cash, start_bal, nper, start_yr, pmt)
+    for stocks, cash in [(60, 10), (0, 0), (100, 0), (0, 100), (30, 30)]
+    for start_bal, nper, start_yr in [
+        (10000, 10, 1970),
+        (10000, 30, 1966),
+        (12345, 92, 1928),
+        (1, 1, 2000),
+    ]
+    for pmt in [0, -500, 1000]
+]
+
+
+@pytest.mark.parametrize("stocks, cash, start_bal, nper, start_yr, pmt", CASES)
+def test_backtest_matches_loop(stocks, cash, start_bal, nper, start_yr, pmt):
+    expected = loop_backtest(stocks, cash, start_bal, nper, start_yr, pmt)
+
+    returns = historic.df[
+        (historic.df.Year >= start_yr) & (historic.df.Year <= start_yr + nper - 1)
+    ]
+    _, total, _ = historic.backtest_kernel(
+        returns[historic.ASSET_RETURNS].to_numpy(),
+        historic.allocation(stocks, cash),
+        start_bal,
+        pmt,
+        returns["Inflation"].to_numpy(),
+    )
+    np.testing.assert_allclose(total, expected, rtol=1e-9, atol=1e-6)
+
+    dff = historic.backtest(stocks, cash, start_bal, nper, start_yr, pmt)
+    np.testing.assert_allclose(dff["Total"], expected.round(0), rtol=0, atol=1)
+
+
+def test_backtest_rounding():
+    # the loop's balance for 1970 is exactly 10968.5, which rounds to even
+    dff = historic.backtest(30, 30, 10000, 10, 1970, 0)
+    assert loop_backtest(30, 30, 10000, 10, 1970)[1] == 10968.5
+    assert abs(dff["Total"].iat[1] - 10968) <= 1
+
+
+def test_cashflow_stops_when_money_runs_out():
+    dff = historic.backtest(50, 10, 10000, 30, 1966, -1500)
+    ran_out = dff.index[dff["Total"] <= 0][0]
+
+    # the last withdrawal is what was left, then nothing
+    assert dff["Cashflow"].iat[ran_out] == -dff["Total"].iat[ran_out - 1]
+    assert (dff["Cashflow"].iloc[ran_out + 1 :] == 0).all()